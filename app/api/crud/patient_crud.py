@@ -1,28 +1,101 @@
 # crud/patient_crud.py
 from typing import Optional, List
-from datetime import datetime
+from datetime import date, datetime
 from app.core.db import get_db
+from app.core.cache import invalidate
 from bson import ObjectId
 
 # Database will be obtained through dependency injection
 
+# upper bound on documents materialized per list query; page with skip/limit for more
+DEFAULT_PAGE_SIZE = 1000
+
+# fields read by services/analytics.records_to_df; everything else stays on the server
+METRICS_PROJECTION = {
+    "_id": 0,
+    "patient_id": 1,
+    "timestamp": 1,
+    "happiness": 1,
+    "phq9_score": 1,
+    "gad7_score": 1,
+    "session_title": 1,
+}
+
+# time-series collections only accept BSON dates in their timeField, and range queries
+# compare dates, so ISO strings (as sent by clients) are parsed before insert
+def _as_datetime(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    raise ValueError(f"Expected a datetime or ISO 8601 string, got {type(value).__name__}")
+
 # insert one patient data record (we store in a 'patient_metrics' collection)
 async def insert_patient_data(db, payload: dict):
+    # patient_metrics is a time-series collection: every document needs its timeField
+    payload["timestamp"] = _as_datetime(payload["timestamp"]) if payload.get("timestamp") is not None else datetime.utcnow()
+    if payload.get("date") is not None:
+        payload["date"] = _as_datetime(payload["date"])
     res = await db.patient_metrics.insert_one(payload)
+    # drop cached analytics for this student, and counselor and admin analytics (which
+    # aggregate over students, including the org report), so dashboards pick up the new record
+    await invalidate(f"student:{payload['patient_id']}:")
+    await invalidate("counselor:")
+    await invalidate("admin:")
     return res.inserted_id
 
-# query patient metrics by patient_id range etc.
-async def get_patient_metrics(db, patient_id: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[dict]:
-    q = {"patient_id": patient_id}
-    if start or end:
-        q["$and"] = []
-        if start:
-            q["$and"].append({"timestamp": {"$gte": start}})
-        if end:
-            q["$and"].append({"timestamp": {"$lte": end}})
-        if not q["$and"]:
-            q.pop("$and")
-    cursor = db.patient_metrics.find(q).sort("timestamp", 1)
+def _time_range(field: str, start: Optional[datetime], end: Optional[datetime]) -> dict:
+    if not (start or end):
+        return {}
+    ts = {}
+    if start: ts["$gte"] = start
+    if end: ts["$lte"] = end
+    return {field: ts}
+
+# join each patient's newest `limit` rows (after skipping `skip` newer ones) from `collection`,
+# returned oldest first per patient; sorting newest first before the $limit keeps the cap
+# from dropping the most recent data, and the bound applies to each patient separately
+def _latest_per_patient(collection: str, time_field: str, range_match: dict, projection: dict, limit: int, skip: int = 0) -> List[dict]:
+    stages = [{"$match": range_match}] if range_match else []
+    stages.append({"$sort": {time_field: -1}})
+    if skip:
+        stages.append({"$skip": skip})
+    stages += [{"$limit": limit}, {"$sort": {time_field: 1}}, {"$project": projection}]
+    return [
+        {"$group": {"_id": "$patient_id"}},
+        {"$sort": {"_id": 1}},
+        {"$lookup": {
+            "from": collection,
+            "localField": "_id",
+            "foreignField": "patient_id",
+            "pipeline": stages,
+            "as": "rows",
+        }},
+        {"$unwind": "$rows"},
+        {"$replaceRoot": {"newRoot": "$rows"}},
+    ]
+
+# query patient metrics by patient_id range etc.; returns the newest `limit` records, oldest
+# first, and `skip` pages further back in time
+async def get_patient_metrics(db, patient_id: str, start: Optional[datetime] = None, end: Optional[datetime] = None, limit: int = DEFAULT_PAGE_SIZE, skip: int = 0) -> List[dict]:
+    q = {"patient_id": patient_id, **_time_range("timestamp", start, end)}
+    # force the {patient_id, timestamp} index so the range + sort is a single (backward) index scan
+    cursor = db.patient_metrics.find(q, METRICS_PROJECTION).sort("timestamp", -1).hint([("patient_id", 1), ("timestamp", 1)])
+    docs = await cursor.skip(skip).limit(limit).to_list(length=None)
+    docs.reverse()
+    return docs
+
+# query metrics for many patients in one round trip, ordered by patient then time, with the
+# same per-patient bound as get_patient_metrics
+async def get_patient_metrics_bulk(db, patient_ids: List[str], start: Optional[datetime] = None, end: Optional[datetime] = None, limit: int = DEFAULT_PAGE_SIZE) -> List[dict]:
+    if not patient_ids:
+        return []
+    range_match = _time_range("timestamp", start, end)
+    pipeline = [{"$match": {"patient_id": {"$in": patient_ids}, **range_match}}]
+    pipeline += _latest_per_patient("patient_metrics", "timestamp", range_match, METRICS_PROJECTION, limit)
+    cursor = db.patient_metrics.aggregate(pipeline)
     return await cursor.to_list(length=None)
 
 # get all patients seen by a counselor (assumes sessions collection stored relations)
@@ -31,12 +104,22 @@ async def get_students_of_counselor(db, counselor_id: str) -> List[str]:
     cursor = db.sessions.distinct("patient_id", {"therapist_id": counselor_id})
     return await cursor
 
-# fetch latest session titles for a list of patient ids
-async def get_session_titles(db, patient_ids: List[str], start: Optional[datetime] = None, end: Optional[datetime] = None):
-    q = {"patient_id": {"$in": patient_ids}}
-    if start or end:
-        q["date"] = {}
-        if start: q["date"]["$gte"] = start
-        if end: q["date"]["$lte"] = end
-    cursor = db.session_summaries.find(q, {"patient_id": 1, "title": 1, "date": 1})
+# fetch latest session titles for a list of patient ids: the newest `limit` per patient
+# (oldest first), so one patient with many sessions can't push the others out
+async def get_session_titles(db, patient_ids: List[str], start: Optional[datetime] = None, end: Optional[datetime] = None, limit: int = DEFAULT_PAGE_SIZE, skip: int = 0):
+    if not patient_ids:
+        return []
+    range_match = _time_range("date", start, end)
+    pipeline = [{"$match": {"patient_id": {"$in": patient_ids}, **range_match}}]
+    pipeline += _latest_per_patient("session_summaries", "date", range_match, {"patient_id": 1, "title": 1, "date": 1}, limit, skip)
+    cursor = db.session_summaries.aggregate(pipeline)
+    return await cursor.to_list(length=None)
+
+# fetch metrics for every student of a counselor in one round trip (instead of distinct
+# then find): $match on the indexed therapist_id first, then join patient_metrics per patient
+async def get_counselor_metrics(db, counselor_id: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[dict]:
+    # same per-patient bound and ordering as get_patient_metrics
+    pipeline = [{"$match": {"therapist_id": counselor_id}}]
+    pipeline += _latest_per_patient("patient_metrics", "timestamp", _time_range("timestamp", start, end), METRICS_PROJECTION, DEFAULT_PAGE_SIZE)
+    cursor = db.sessions.aggregate(pipeline)
     return await cursor.to_list(length=None)
@@ -1,17 +1,59 @@
-from fastapi import APIRouter, Depends, HTTPException
+import logging
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
 from typing import List, Optional
 from datetime import datetime
+import io
+import zipfile
+import asyncio
+from cachetools import TTLCache
+from bson import ObjectId
 
 from app.core.security import require_roles
 from app.api.services.analytics_service import AnalyticsService
-from app.api.services.pdf_generator import PDFService
+from app.api.services.pdf_generator import PDFService, PLACEHOLDER_PDF
 from app.core.db import get_db
+from app.core import cache
 
 router = APIRouter(prefix="/admin", tags=["Admin"])
 
+logger = logging.getLogger(__name__)
+
 analytics_service = AnalyticsService()
 pdf_service = PDFService()
 
+# Org reports are expensive and change slowly: build them in the background
+# and serve the finished artifact for the rest of the hour (or until new data
+# invalidates the admin analytics it is built from).
+_org_report_cache = cache.register(TTLCache(maxsize=4, ttl=3600), prefix="admin")
+_org_report_building = set()
+
+
+def _org_report_bucket() -> str:
+    return datetime.utcnow().strftime("%Y-%m-%dT%H")
+
+
+async def _build_org_report(bucket: str):
+    try:
+        data = await analytics_service.get_admin_overall_analytics()
+        if "error" in data:
+            logger.error("Org report analytics failed: %s", data["error"])
+            return
+        pdf_bytes = await pdf_service.generate_admin_pdf(data)
+        if pdf_bytes is not PLACEHOLDER_PDF:
+            _org_report_cache[bucket] = pdf_bytes
+    finally:
+        _org_report_building.discard(bucket)
+
+
+async def validate_refs(db, ids: List[str]) -> set:
+    """Return the subset of `ids` that exist in the analytics collection, using one $in query."""
+    object_ids = [ObjectId(i) for i in set(ids) if ObjectId.is_valid(i)]
+    if not object_ids:
+        return set()
+    cursor = db.analytics.find({"_id": {"$in": object_ids}}, {"_id": 1})
+    return {str(doc["_id"]) for doc in await cursor.to_list(length=len(object_ids))}
+
 
 @router.post("/org/analytics")
 async def organization_analytics(
@@ -26,6 +68,15 @@ async def organization_analytics(
     return await analytics_service.get_admin_overall_analytics(start_date, end_date)
 
 
+@router.post("/cache/flush")
+async def flush_analytics_cache(current_user=Depends(require_roles("admin"))):
+    """
+    Drop all cached analytics so the next dashboard request recomputes from MongoDB.
+    """
+    flushed = await cache.flush()
+    return {"flushed": flushed, **cache.cache_stats}
+
+
 @router.get("/therapists")
 async def list_therapists(current_user=Depends(require_roles("admin"))):
     """
@@ -35,17 +86,63 @@ async def list_therapists(current_user=Depends(require_roles("admin"))):
 
 
 @router.get("/reports/pdf")
-async def generate_org_report_pdf(current_user=Depends(require_roles("admin"))):
+async def generate_org_report_pdf(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    current_user=Depends(require_roles("admin"))
+):
     """
     Generate an organization-wide PDF report (all students, counselors, and insights).
+    The report is built in the background; poll this endpoint until it returns the file.
     """
-    data = await analytics_service.get_admin_overall_analytics()
-    pdf_bytes = await pdf_service.generate_admin_pdf(data)
+    bucket = _org_report_bucket()
+    pdf_bytes = _org_report_cache.get(bucket)
+    if pdf_bytes is not None:
+        return Response(
+            content=pdf_bytes,
+            media_type="application/pdf",
+            headers={"Content-Disposition": "attachment; filename=organization_report.pdf"}
+        )
+
+    if bucket not in _org_report_building:
+        _org_report_building.add(bucket)
+        background_tasks.add_task(_build_org_report, bucket)
+
+    return JSONResponse(
+        status_code=202,
+        content={"status": "pending", "poll_url": request.url.path}
+    )
 
-    return {
-        "filename": "organization_report.pdf",
-        "file_base64": pdf_bytes
+
+@router.post("/reports/students/pdf")
+async def export_student_reports(
+    student_ids: List[str],
+    current_user=Depends(require_roles("admin"))
+):
+    """
+    Bulk-export student PDF reports as one zip archive (one PDF per student).
+    """
+    student_ids = list(dict.fromkeys(student_ids))
+    analytics = await asyncio.gather(
+        *(analytics_service.get_student_happiness(sid) for sid in student_ids)
+    )
+    reports = {
+        sid: {"happiness_data": data}
+        for sid, data in zip(student_ids, analytics)
+        if not (isinstance(data, dict) and "error" in data)
     }
+    pdfs = await pdf_service.generate_students_pdfs_bulk(reports)
+
+    # PDFs are already compressed, so store them as-is
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        for sid in student_ids:
+            archive.writestr(f"student_{sid}.pdf", pdfs.get(sid, PLACEHOLDER_PDF))
+    return Response(
+        content=buffer.getvalue(),
+        media_type="application/zip",
+        headers={"Content-Disposition": "attachment; filename=student_reports.zip"}
+    )
 
 
 @router.post("/publish-article")
@@ -53,21 +150,26 @@ async def publish_article(
     title: str,
     body: str,
     analytics_refs: List[str] = [],
-    current_user=Depends(require_roles("admin"))
+    current_user=Depends(require_roles("admin")),
+    db=Depends(get_db)
 ):
     """
     Admin publishes article using analytics data.
     Stored in 'articles' collection in MongoDB.
     """
-    async for db in get_db():
-        doc = {
-            "title": title,
-            "body": body,
-            "analytics_refs": analytics_refs,
-            "author_id": current_user["id"],
-            "published_at": datetime.utcnow()
-        }
-        res = await db.articles.insert_one(doc)
-        break
+    if analytics_refs:
+        valid_refs = await validate_refs(db, analytics_refs)
+        unknown_refs = [ref for ref in analytics_refs if ref not in valid_refs]
+        if unknown_refs:
+            raise HTTPException(status_code=400, detail=f"Unknown analytics refs: {', '.join(unknown_refs)}")
+
+    doc = {
+        "title": title,
+        "body": body,
+        "analytics_refs": analytics_refs,
+        "author_id": current_user.id,
+        "published_at": datetime.utcnow()
+    }
+    res = await db.articles.insert_one(doc)
 
     return {"article_id": str(res.inserted_id), "status": "published"}
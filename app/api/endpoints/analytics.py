@@ -1,14 +1,15 @@
 from fastapi import APIRouter, HTTPException, Response
 from app.api.services.analytics_service import AnalyticsService
-from app.api.services.pdf_generator import PDFService
-import base64
+from app.api.services.pdf_generator import PDFService, PLACEHOLDER_PDF
 
 router = APIRouter()
 
+analytics_service = AnalyticsService()
+pdf_service = PDFService()
+
 @router.get("/student/{student_id}")
 async def get_student_analytics(student_id: str):
-    svc = AnalyticsService()
-    data = await svc.get_student_happiness(student_id)
+    data = await analytics_service.get_student_happiness(student_id)
     if isinstance(data, dict) and "error" in data:
         # Graceful fallback when DB not ready or no data
         return {
@@ -23,22 +24,10 @@ async def get_student_analytics(student_id: str):
 
 @router.get("/pdf/{student_id}")
 async def get_student_pdf(student_id: str):
-    svc = AnalyticsService()
-    pdfs = PDFService()
-
-    analytics = await svc.get_student_happiness(student_id)
+    analytics = await analytics_service.get_student_happiness(student_id)
     if isinstance(analytics, dict) and "error" in analytics:
         # Return a minimal placeholder PDF so UI doesn't break
-        placeholder = b"%PDF-1.4\n1 0 obj<<>>endobj\ntrailer<<>>\n%%EOF"
-        return Response(content=placeholder, media_type="application/pdf")
-
-    # generate base64 PDF then return as binary bytes
-    pdf_b64 = await pdfs.generate_student_pdf(student_id, {"happiness_data": analytics})
-    try:
-        pdf_bytes = base64.b64decode(pdf_b64)
-    except Exception as exc:
-        # Fallback to placeholder PDF on decode error
-        placeholder = b"%PDF-1.4\n1 0 obj<<>>endobj\ntrailer<<>>\n%%EOF"
-        return Response(content=placeholder, media_type="application/pdf")
+        return Response(content=PLACEHOLDER_PDF, media_type="application/pdf")
 
+    pdf_bytes = await pdf_service.generate_student_pdf(student_id, {"happiness_data": analytics})
     return Response(content=pdf_bytes, media_type="application/pdf")
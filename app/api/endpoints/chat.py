@@ -1,13 +1,18 @@
+import logging
 from fastapi import APIRouter, HTTPException, Body
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Dict, Any, Optional
 from app.api.services.ai_services import bestie_service, moderation_service
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
+# Bounds on a chat message, shared with the /chat adapter's request model
+MIN_CHAT_MESSAGE_LENGTH = 1
+MAX_CHAT_MESSAGE_LENGTH = 1000
 
 class ChatMessage(BaseModel):
-    message: str = Field(..., min_length=1, max_length=1000, description="User's message to Bestie")
+    message: str = Field(..., min_length=MIN_CHAT_MESSAGE_LENGTH, max_length=MAX_CHAT_MESSAGE_LENGTH, description="User's message to Bestie")
     history: List[Dict[str, Any]] = Field(default=[], description="Previous conversation history")
     user_id: Optional[str] = Field(None, description="User ID if authenticated")
     topic: Optional[str] = Field(None, description="Conversation topic")
@@ -15,6 +20,9 @@ class ChatMessage(BaseModel):
     session_id: Optional[str] = Field(None, description="Session ID for tracking")
 
 class ChatResponse(BaseModel):
+    # built once per request and never mutated
+    model_config = ConfigDict(frozen=True)
+
     response: str = Field(..., description="Bestie's response message")
     agent: Optional[str] = Field(None, description="AI agent that generated the response")
     crisis_detected: bool = Field(default=False, description="Whether crisis was detected")
@@ -35,55 +43,64 @@ async def ask_bestie(chat_message: ChatMessage):
         if not chat_message.message.strip():
             raise HTTPException(status_code=400, detail="Message cannot be empty")
         
-        # Try to use AI service first
-        try:
-            result = await bestie_service.process_message(
-                message=chat_message.message,
-                history=chat_message.history,
-                user_id=chat_message.user_id,
-                topic=chat_message.topic
-            )
-            
-            # Use AI response if successful
-            response_data = {
-                "response": result.get("message", result.get("response", "I'm here to listen and support you.")),
-                "agent": result.get("agent", "listener"),
-                "crisis_detected": result.get("crisis_detected", False),
-                "crisis_level": result.get("crisis_level"),
-                "type": result.get("type", "chat"),
-                "metadata": result.get("metadata", {
-                    "user_id": chat_message.user_id,
-                    "topic": chat_message.topic
-                })
-            }
-        except Exception as ai_error:
-            print(f"AI service error (using fallback): {ai_error}")
-            # Fallback response if AI service fails
-            response_data = {
-                "response": f"I hear you saying: '{chat_message.message}'. I'm here to listen and support you. How are you feeling right now?",
-                "agent": "listener",
-                "crisis_detected": False,
-                "crisis_level": None,
-                "type": "chat",
-                "metadata": {
-                    "user_id": chat_message.user_id,
-                    "topic": chat_message.topic,
-                    "fallback": True
-                }
-            }
-        
-        return ChatResponse(**response_data)
+        return await bestie_reply(chat_message)
         
     except HTTPException:
         raise
-    except Exception as e:
-        print(f"Error in chat endpoint: {e}")
+    except Exception:
+        logger.exception("Error in chat endpoint", extra={"user_id": chat_message.user_id})
         raise HTTPException(
             status_code=500,
             detail="Internal server error while processing your message"
         )
 
 
+async def bestie_reply(chat_message: ChatMessage, analysis: Optional[Dict[str, Any]] = None) -> ChatResponse:
+    """
+    Run a message through Bestie, with a fallback reply if the AI service fails.
+    Pass `analysis` when the caller already ran SafetyService.analyze on the message.
+    """
+    # Try to use AI service first
+    try:
+        result = await bestie_service.process_message(
+            message=chat_message.message,
+            history=chat_message.history,
+            user_id=chat_message.user_id,
+            topic=chat_message.topic,
+            analysis=analysis
+        )
+        
+        # Use AI response if successful
+        response_data = {
+            "response": result.get("message", result.get("response", "I'm here to listen and support you.")),
+            "agent": result.get("agent", "listener"),
+            "crisis_detected": result.get("crisis_detected", False),
+            "crisis_level": result.get("crisis_level"),
+            "type": result.get("type", "chat"),
+            "metadata": result.get("metadata", {
+                "user_id": chat_message.user_id,
+                "topic": chat_message.topic
+            })
+        }
+    except Exception:
+        logger.exception("AI service error (using fallback)", extra={"user_id": chat_message.user_id})
+        # Fallback response if AI service fails
+        response_data = {
+            "response": f"I hear you saying: '{chat_message.message}'. I'm here to listen and support you. How are you feeling right now?",
+            "agent": "listener",
+            "crisis_detected": False,
+            "crisis_level": None,
+            "type": "chat",
+            "metadata": {
+                "user_id": chat_message.user_id,
+                "topic": chat_message.topic,
+                "fallback": True
+            }
+        }
+    
+    return ChatResponse(**response_data)
+
+
 @router.post("/summarize")
 async def summarize_chat(
     messages: List[Dict[str, Any]] = Body(...),
@@ -115,8 +132,8 @@ async def summarize_chat(
         
     except HTTPException:
         raise
-    except Exception as e:
-        print(f"Error in summarize endpoint: {e}")
+    except Exception:
+        logger.exception("Error in summarize endpoint", extra={"session_id": session_id})
         raise HTTPException(
             status_code=500,
             detail="Failed to generate chat summary"
@@ -1,9 +1,11 @@
+import logging
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, Field
 from typing import Dict, Any
 from app.api.services.ai_services import moderation_service
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 class ModerationRequest(BaseModel):
     text: str = Field(..., min_length=1, max_length=2000, description="Text content to moderate")
@@ -35,8 +37,8 @@ async def moderate_post(request: ModerationRequest):
         
     except HTTPException:
         raise
-    except Exception as e:
-        print(f"Error in moderation endpoint: {e}")
+    except Exception:
+        logger.exception("Error in moderation endpoint")
         raise HTTPException(
             status_code=500,
             detail="Internal server error while moderating content"
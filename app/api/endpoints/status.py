@@ -1,9 +1,38 @@
+import os
+import re
+from functools import lru_cache
 from fastapi import APIRouter
 from typing import Dict, Any
+from app.core.config import settings
 from app.api.services.ai_services import bestie_service
 
 router = APIRouter()
 
+# Google API key shape: 'AIza' prefix, at least 20 chars, no whitespace
+_API_KEY_RE = re.compile(r"\AAIza\S{16,}\Z")
+
+
+@lru_cache(maxsize=2)
+def validate_api_key_format(key: str) -> Dict[str, Any]:
+    """API key format validation (cached: the env and settings keys rarely change)"""
+    # Single pass for well-formed keys; the checks below only explain a failure
+    if _API_KEY_RE.match(key):
+        return {"valid": True, "reason": "Format appears valid"}
+    
+    if not key or key.strip() == "":
+        return {"valid": False, "reason": "API key is empty"}
+    
+    if key == "YOUR_NEW_API_KEY_HERE":
+        return {"valid": False, "reason": "API key is still placeholder"}
+    
+    if not key.startswith("AIza"):
+        return {"valid": False, "reason": "API key doesn't start with 'AIza' (Google format)"}
+    
+    if len(key) < 20:
+        return {"valid": False, "reason": "API key is too short"}
+    
+    return {"valid": False, "reason": "API key contains whitespace"}
+
 @router.get("/api-status")
 async def get_api_status() -> Dict[str, Any]:
     """
@@ -69,7 +98,7 @@ async def reset_rate_limits() -> Dict[str, Any]:
         service = bestie_service.gemini_service
         
         # Reset rate limiting
-        service.request_timestamps = []
+        service.request_timestamps.clear()
         service.backoff_until = None
         service.consecutive_failures = 0
         
@@ -94,32 +123,10 @@ async def diagnose_api_key() -> Dict[str, Any]:
     Returns detailed information to help troubleshoot API key problems
     """
     try:
-        from app.core.config import settings
-        import os
-        
         # Check environment variables
         api_key_from_env = os.getenv("GEMINI_API_KEY")
         api_key_from_settings = settings.GEMINI_API_KEY
         
-        # API key format validation
-        def validate_api_key_format(key: str) -> Dict[str, Any]:
-            if not key or key.strip() == "":
-                return {"valid": False, "reason": "API key is empty"}
-            
-            if key == "YOUR_NEW_API_KEY_HERE":
-                return {"valid": False, "reason": "API key is still placeholder"}
-            
-            if not key.startswith("AIza"):
-                return {"valid": False, "reason": "API key doesn't start with 'AIza' (Google format)"}
-            
-            if len(key) < 20:
-                return {"valid": False, "reason": "API key is too short"}
-            
-            if " " in key or "\n" in key or "\r" in key:
-                return {"valid": False, "reason": "API key contains whitespace"}
-            
-            return {"valid": True, "reason": "Format appears valid"}
-        
         env_validation = validate_api_key_format(api_key_from_env or "")
         settings_validation = validate_api_key_format(api_key_from_settings or "")
         
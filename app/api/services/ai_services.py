@@ -1,13 +1,191 @@
 import google.generativeai as genai
 from typing import List, Dict, Any, Optional
-import json
+import logging
+import re
 import asyncio
 import time
+import random
+from random import choice as _choice
 import hashlib
+import heapq
+import struct
+from collections import deque
 from datetime import datetime, timedelta
+import orjson
+from cachetools import TTLCache
 from app.core.config import settings
 from app.core.security import safety_service
 
+logger = logging.getLogger(__name__)
+
+# Fallback keyword triggers per category, in precedence order.
+# Plain substring matching (no \b) like the original `in` checks; word boundaries
+# misfire on Devanagari combining marks.
+_FALLBACK_KEYWORDS = {
+    "anxiety": ['anxious', 'worried', 'panic', 'overwhelmed', 'stressed', 'चिंता', 'परेशान', 'تناؤ', 'tension'],
+    "sadness": ['sad', 'depressed', 'down', 'hopeless', 'empty', 'उदास', 'दुखी', 'غمگین', 'udaas'],
+    "study": ['study', 'exam', 'academic', 'pressure', 'grades', 'पढ़ाई', 'امتحان', 'padhai', 'imtihaan'],
+}
+
+# All categories in one pass: a named group per category inside a zero-width lookahead,
+# so overlapping keywords from different categories are all reported
+_FALLBACK_RE = re.compile(
+    "(?=" + "|".join(
+        f"(?P<{category}>{'|'.join(map(re.escape, words))})"
+        for category, words in _FALLBACK_KEYWORDS.items()
+    ) + ")",
+    re.IGNORECASE
+)
+
+# Multi-language anxiety responses (first-aid with coping strategies)
+_ANXIETY_RESPONSES = (
+    "Yaar, I can tell you're feeling anxious right now. Let's try this first-aid technique: Take 4 deep breaths - in for 4, hold for 4, out for 4. What's causing this stress, bro?",
+    "Bhai, anxiety feels overwhelming na? Try the 5-4-3-2-1 technique: Name 5 things you see, 4 you can touch, 3 you hear, 2 you smell, 1 you taste. Kya specific thing is worrying you?",
+    "Dude, that anxiety is real but manageable. Quick tip: Put your hand on your chest, feel your heartbeat, breathe with it. Now tell me what's the main stressor?",
+    "Hey yaar, anxiety attack? Try cold water on your wrists or drink some water slowly. Main hoon na - what's weighing heavy on your mind right now?",
+)
+
+# Multi-language sadness responses (first-aid with coping strategies)
+_SADNESS_RESPONSES = (
+    "Bro, sounds like you're going through a tough time. Quick first-aid: Try to get some sunlight or bright light, even for 10 minutes. Your feelings are valid - what's been happening?",
+    "Yaar, I can hear you're struggling. First-aid tip: Do one small thing you normally enjoy - chai, music, calling a friend. Kab se feeling this way?",
+    "Bhai, those heavy feelings are real. Try this: Write down 3 small things you're grateful for today. Main yahan hoon - what's been the hardest part?",
+    "Dude, when feeling low, movement helps - even 5 minutes walking. Your feelings matter, no judgment here. Kya specifically going on?",
+)
+
+# Academic stress (first-aid with study coping strategies)
+_STUDY_RESPONSES = (
+    "Yaar, academic pressure is real. First-aid tip: Break your study into 25-min chunks with 5-min breaks (Pomodoro). Your worth isn't your grades, bro. Which subject is stressing you most?",
+    "Bhai, exam stress is tough! Try this: Study for 45 mins, then do something fun for 15 mins. You're doing your best - what's the biggest challenge abhi?",
+    "Dude, study pressure getting to you? Quick tip: Make a simple today-only to-do list with just 3 tasks. Sab students feel this - what would help you feel more prepared?",
+    "Bro, studies overwhelming you? Try the 2-minute rule: If it takes less than 2 mins, do it now. You're more than your marks - kya specifically bothering you?",
+)
+
+# General supportive responses (bro style with multilingual)
+_GENERAL_RESPONSES = (
+    "Thanks for sharing that with me, yaar. Your feelings are completely valid. What's been on your mind lately?",
+    "Bro, I can hear this is important to you. What would be most helpful to talk about right now?",
+    "Takes courage to reach out, dude. I'm glad you're here. Kaisa feeling today?",
+    "Yaar, that sounds like a lot to handle. What's been the most challenging part for you?",
+    "I'm here to listen and support you, bhai. What's weighing on your dil right now?",
+    "That sounds tough to deal with, bro. You don't have to face this alone. Kya chal raha hai?",
+    "Hey yaar, main sun raha hoon. Whatever it is, we can talk through it. What's going on?",
+)
+
+_FALLBACK_RESPONSES = {
+    "anxiety": _ANXIETY_RESPONSES,
+    "sadness": _SADNESS_RESPONSES,
+    "study": _STUDY_RESPONSES,
+}
+
+
+class CircuitBreaker:
+    """Opens after `fail_max` consecutive failures; lets one trial call through after `reset_timeout` seconds"""
+    
+    def __init__(self, fail_max: int = 5, reset_timeout: float = 30):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self.failure_count = 0
+        self.opened_at = None
+        # Start of the half-open trial call; a trial that never reports back (cancelled,
+        # or skipped by the rate limiter) stops blocking others after reset_timeout
+        self._trial_started_at = None
+    
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+    
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "open":
+            return False
+        # Half-open: only a single trial call goes through; everyone else gets the fallback
+        now = time.monotonic()
+        if self._trial_started_at is not None and now - self._trial_started_at < self.reset_timeout:
+            return False
+        self._trial_started_at = now
+        return True
+    
+    def record_success(self):
+        self.failure_count = 0
+        self.opened_at = None
+        self._trial_started_at = None
+    
+    def record_failure(self):
+        self._trial_started_at = None
+        self.failure_count += 1
+        # A failed half-open trial has failure_count >= fail_max, so this re-opens the circuit
+        if self.failure_count >= self.fail_max:
+            self.opened_at = time.monotonic()
+
+
+class ClockCache:
+    """Fixed-capacity map with CLOCK (second-chance) eviction: a hit sets a bit instead of reordering"""
+    
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._index: Dict[Any, int] = {}  # key -> slot
+        self._keys: List[Any] = [None] * maxsize
+        self._values: List[Any] = [None] * maxsize
+        self._referenced = bytearray(maxsize)
+        self._free = list(range(maxsize - 1, -1, -1))
+        self._hand = 0
+    
+    def __len__(self) -> int:
+        return len(self._index)
+    
+    def __contains__(self, key) -> bool:
+        return key in self._index
+    
+    def get(self, key, default=None):
+        """Look up a value and mark it recently used"""
+        slot = self._index.get(key)
+        if slot is None:
+            return default
+        self._referenced[slot] = 1
+        return self._values[slot]
+    
+    def peek(self, key, default=None):
+        """Look up a value without touching its reference bit"""
+        slot = self._index.get(key)
+        return default if slot is None else self._values[slot]
+    
+    def __setitem__(self, key, value):
+        slot = self._index.get(key)
+        if slot is None:
+            slot = self._free.pop() if self._free else self._evict()
+            self._index[key] = slot
+            self._keys[slot] = key
+        self._values[slot] = value
+    
+    def pop(self, key, default=None):
+        slot = self._index.pop(key, None)
+        if slot is None:
+            return default
+        value = self._values[slot]
+        self._keys[slot] = None
+        self._values[slot] = None
+        self._referenced[slot] = 0
+        self._free.append(slot)
+        return value
+    
+    def _evict(self) -> int:
+        """Advance the hand past referenced slots (clearing them) and free the first unreferenced one"""
+        while self._referenced[self._hand]:
+            self._referenced[self._hand] = 0
+            self._hand = (self._hand + 1) % self.maxsize
+        slot = self._hand
+        del self._index[self._keys[slot]]
+        self._hand = (slot + 1) % self.maxsize
+        return slot
+
+
 class GeminiService:
     """Service for interacting with Google Gemini AI with rate limiting and caching"""
     
@@ -18,92 +196,135 @@ class GeminiService:
         # Rate limiting (Gemini free tier: 15 RPM)
         self.requests_per_minute = 10  # Conservative limit
         self.max_tokens_per_day = 50000  # Conservative daily limit
-        self.request_timestamps = []
+        self.request_timestamps = deque()  # time.monotonic() of each request, oldest first
         self.daily_token_count = 0
-        self.last_reset_date = datetime.now().date()
+        self.next_daily_reset = self._next_midnight()  # wall-clock epoch seconds
         
         # Caching for similar requests
-        self.response_cache = {}
+        self.cache_max_size = 100
+        self.response_cache = ClockCache(maxsize=self.cache_max_size)
         self.cache_ttl = 3600  # 1 hour cache TTL
+        self._expiry_heap: list[tuple[float, bytes]] = []  # (expiry, cache_key), soonest first
         
-        # Backoff strategy
+        # Backoff strategy (backoff_until is a time.monotonic() deadline)
         self.backoff_until = None
         self.consecutive_failures = 0
+        
+        # Futures for prompts currently being sent to Gemini, keyed like the response cache
+        self._in_flight: dict[bytes, asyncio.Future] = {}
+        
+        # GenerationConfig per temperature; everything else in it is fixed
+        self._gen_configs: dict[float, genai.types.GenerationConfig] = {}
+        
+        # Skip Gemini entirely while it keeps failing, instead of waiting out each timeout
+        self.circuit_breaker = CircuitBreaker(fail_max=5, reset_timeout=30)
     
     def _initialize_model(self):
         """Initialize the Gemini model"""
         try:
             if not settings.GEMINI_API_KEY or settings.GEMINI_API_KEY.strip() == "":
-                print("⚠️  No Gemini API key found - running in fallback mode")
+                logger.warning("No Gemini API key found - running in fallback mode")
                 self.model = None
                 return
                 
             genai.configure(api_key=settings.GEMINI_API_KEY)
             self.model = genai.GenerativeModel(settings.GEMINI_MODEL)
-            print("✅ Gemini model initialized successfully")
+            logger.info("Gemini model initialized successfully")
         except Exception as e:
-            print(f"❌ Failed to initialize Gemini model: {e} - running in fallback mode")
+            logger.error("Failed to initialize Gemini model: %s - running in fallback mode", e)
             self.model = None
     
+    def _prune_request_timestamps(self):
+        """Drop request timestamps older than the one-minute window"""
+        cutoff = time.monotonic() - 60.0
+        while self.request_timestamps and self.request_timestamps[0] < cutoff:
+            self.request_timestamps.popleft()
+    
+    @staticmethod
+    def _next_midnight() -> float:
+        """Epoch seconds of the next local midnight"""
+        tomorrow = datetime.now().date() + timedelta(days=1)
+        return datetime.combine(tomorrow, datetime.min.time()).timestamp()
+    
     def _check_rate_limit(self) -> bool:
         """Check if we can make an API request based on rate limits"""
-        now = datetime.now()
+        now = time.monotonic()
         
         # Reset daily counter if new day
-        if now.date() > self.last_reset_date:
+        if time.time() >= self.next_daily_reset:
             self.daily_token_count = 0
-            self.last_reset_date = now.date()
-            print(f"🔄 Daily token counter reset")
+            self.next_daily_reset = self._next_midnight()
+            logger.info("Daily token counter reset")
         
         # Check if we're in backoff period
         if self.backoff_until and now < self.backoff_until:
-            remaining = (self.backoff_until - now).seconds
-            print(f"⏳ In backoff period, {remaining} seconds remaining")
+            remaining = int(self.backoff_until - now)
+            logger.info("In backoff period, %d seconds remaining", remaining)
             return False
         
         # Clean old timestamps (keep only last minute)
-        cutoff = now - timedelta(minutes=1)
-        self.request_timestamps = [ts for ts in self.request_timestamps if ts > cutoff]
+        self._prune_request_timestamps()
         
         # Check RPM limit
         if len(self.request_timestamps) >= self.requests_per_minute:
-            print(f"⚠️ Rate limit exceeded: {len(self.request_timestamps)}/{self.requests_per_minute} RPM")
+            logger.warning("Rate limit exceeded: %d/%d RPM", len(self.request_timestamps), self.requests_per_minute)
             return False
         
         return True
     
-    def _get_cache_key(self, prompt: str, temperature: float) -> str:
+    def _get_cache_key(self, encoded_prompt: bytes, temperature: float) -> bytes:
         """Generate cache key for the request"""
-        # Create hash of prompt + temperature for caching
-        content = f"{prompt}_{temperature}"
-        return hashlib.md5(content.encode()).hexdigest()
+        # Hash UTF-8 prompt + temperature; the raw 16-byte digest is used directly as the dict key
+        h = hashlib.blake2b(digest_size=16)
+        h.update(encoded_prompt)
+        h.update(struct.pack('<d', temperature))
+        return h.digest()
     
-    def _get_cached_response(self, cache_key: str) -> Optional[str]:
+    def _purge_expired(self):
+        """Drop expired cache entries so they don't take slots from live ones"""
+        now = time.monotonic()
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            expiry, cache_key = heapq.heappop(self._expiry_heap)
+            entry = self.response_cache.peek(cache_key)
+            # Skip heap items left behind by a key that was re-cached or already evicted
+            if entry and entry['expiry'] == expiry:
+                self.response_cache.pop(cache_key)
+    
+    def _get_cached_response(self, cache_key: bytes) -> Optional[str]:
         """Get cached response if available and not expired"""
-        if cache_key not in self.response_cache:
-            return None
-        
-        cached_data = self.response_cache[cache_key]
-        if datetime.now() - cached_data['timestamp'] > timedelta(seconds=self.cache_ttl):
-            # Cache expired
-            del self.response_cache[cache_key]
+        self._purge_expired()
+        cached_data = self.response_cache.get(cache_key)
+        if cached_data is None:
             return None
         
-        print(f"💾 Using cached response for request")
+        logger.debug("Using cached response for request")
         return cached_data['response']
     
-    def _cache_response(self, cache_key: str, response: str):
+    def _cache_response(self, cache_key: bytes, response: str):
         """Cache the response"""
+        self._purge_expired()
+        
+        # ClockCache evicts a not-recently-used entry once all slots are taken
+        expiry = time.monotonic() + self.cache_ttl
         self.response_cache[cache_key] = {
             'response': response,
-            'timestamp': datetime.now()
+            'expiry': expiry
         }
-        
-        # Limit cache size (keep last 100 entries)
-        if len(self.response_cache) > 100:
-            oldest_key = min(self.response_cache.keys(), 
-                           key=lambda k: self.response_cache[k]['timestamp'])
-            del self.response_cache[oldest_key]
+        heapq.heappush(self._expiry_heap, (expiry, cache_key))
+    
+    def _get_generation_config(self, temperature: float) -> genai.types.GenerationConfig:
+        """Return the (reused) generation config for a temperature"""
+        key = round(temperature, 2)
+        config = self._gen_configs.get(key)
+        if config is None:
+            config = genai.types.GenerationConfig(
+                temperature=key,
+                max_output_tokens=400,  # Reduced to save quota
+                top_p=0.8,
+                top_k=40
+            )
+            self._gen_configs[key] = config
+        return config
     
     def _handle_rate_limit_error(self, error: Exception):
         """Handle rate limit errors with intelligent backoff"""
@@ -114,21 +335,28 @@ class GeminiService:
         if "retry_delay" in error_str or "30" in error_str:
             backoff_seconds = 35  # Add a bit extra to the suggested 30s
         else:
-            # Exponential backoff: 2^failures * 30 seconds, max 10 minutes
-            backoff_seconds = min(2 ** self.consecutive_failures * 30, 600)
+            # Exponential backoff from 5 seconds, max 10 minutes, with equal jitter
+            # so workers that failed together don't all retry at the same moment
+            base = min(5 * 2 ** (self.consecutive_failures - 1), 600)
+            backoff_seconds = random.uniform(base / 2, base)
         
-        self.backoff_until = datetime.now() + timedelta(seconds=backoff_seconds)
+        self.backoff_until = time.monotonic() + backoff_seconds
         
-        print(f"🚫 Rate limit hit. Backing off for {backoff_seconds} seconds")
-        print(f"📊 API Usage Stats: RPM: {len(self.request_timestamps)}, Daily tokens: {self.daily_token_count}")
+        logger.warning("Rate limit hit. Backing off for %.1f seconds", backoff_seconds)
+        logger.info("API usage: RPM %d, daily tokens %d", len(self.request_timestamps), self.daily_token_count)
     
     def get_api_status(self) -> Dict[str, Any]:
         """Get current API status and usage statistics"""
-        now = datetime.now()
+        now = time.monotonic()
         
         # Clean old timestamps
-        cutoff = now - timedelta(minutes=1)
-        self.request_timestamps = [ts for ts in self.request_timestamps if ts > cutoff]
+        self._prune_request_timestamps()
+        self._purge_expired()
+        
+        # backoff_until is monotonic; convert to wall clock only for display
+        backoff_until = None
+        if self.backoff_until:
+            backoff_until = datetime.fromtimestamp(time.time() + self.backoff_until - now).isoformat()
         
         return {
             "api_key_configured": self.model is not None,
@@ -137,66 +365,100 @@ class GeminiService:
             "tokens_used_today": self.daily_token_count,
             "daily_token_limit": self.max_tokens_per_day,
             "in_backoff": self.backoff_until is not None and now < self.backoff_until,
-            "backoff_until": self.backoff_until.isoformat() if self.backoff_until else None,
+            "backoff_until": backoff_until,
             "consecutive_failures": self.consecutive_failures,
             "cache_size": len(self.response_cache),
-            "quota_exhausted": self.daily_token_count >= self.max_tokens_per_day
+            "quota_exhausted": self.daily_token_count >= self.max_tokens_per_day,
+            "circuit_breaker": {
+                "state": self.circuit_breaker.state,
+                "failure_count": self.circuit_breaker.failure_count
+            }
         }
     
-    def generate_response(self, prompt: str, temperature: float = 0.7) -> str:
+    async def generate_response(self, prompt: str, temperature: float = 0.7) -> str:
         """Generate response from Gemini model with rate limiting and caching"""
+        if self.model is None:
+            return self._generate_fallback_response(prompt)
+        
+        # Check cache first
+        # Encode once: the bytes feed both the cache key and the token estimate
+        encoded_prompt = prompt.encode('utf-8')
+        cache_key = self._get_cache_key(encoded_prompt, temperature)
+        cached_response = self._get_cached_response(cache_key)
+        if cached_response:
+            return cached_response
+        
+        # Identical prompt already waiting on Gemini: share its result instead of spending quota twice
+        in_flight = self._in_flight.get(cache_key)
+        if in_flight is not None:
+            # asyncio.wait so a cancelled follower doesn't cancel the shared future
+            await asyncio.wait((in_flight,))
+            if in_flight.cancelled():
+                return self._generate_fallback_response(prompt)
+            return in_flight.result()
+        
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[cache_key] = future
         try:
-            if self.model is None:
+            response_text = await self._request_gemini(prompt, temperature, cache_key, len(encoded_prompt))
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            self._in_flight.pop(cache_key, None)
+        future.set_result(response_text)
+        return response_text
+    
+    async def _request_gemini(self, prompt: str, temperature: float, cache_key: bytes, prompt_bytes: int) -> str:
+        """Call Gemini for an uncached prompt, falling back when limits or errors prevent it"""
+        try:
+            # Fail fast while the circuit is open
+            if not self.circuit_breaker.allow_request():
+                logger.warning("Circuit open, using fallback response")
                 return self._generate_fallback_response(prompt)
             
-            # Check cache first
-            cache_key = self._get_cache_key(prompt, temperature)
-            cached_response = self._get_cached_response(cache_key)
-            if cached_response:
-                return cached_response
-            
             # Check rate limits
             if not self._check_rate_limit():
-                print(f"⚠️ Rate limit exceeded, using fallback response")
+                logger.warning("Rate limit exceeded, using fallback response")
                 return self._generate_fallback_response(prompt)
             
             # Record request timestamp
-            self.request_timestamps.append(datetime.now())
+            self.request_timestamps.append(time.monotonic())
             
-            # Estimate tokens (rough estimate: 1 token ≈ 4 characters)
-            estimated_tokens = len(prompt) // 4 + 150  # Add output tokens estimate
+            # Estimate tokens from UTF-8 bytes (≈ 4 per token); Devanagari/Arabic chars take 2-3 bytes each and tokenize denser than Latin
+            estimated_tokens = (prompt_bytes >> 2) + 150  # Add output tokens estimate
             
             # Check daily token limit
             if self.daily_token_count + estimated_tokens >= self.max_tokens_per_day:
-                print(f"⚠️ Daily token limit would be exceeded, using fallback")
+                logger.warning("Daily token limit would be exceeded, using fallback")
                 return self._generate_fallback_response(prompt)
             
             # Generate response - FIXED: No system role, just direct prompt
-            response = self.model.generate_content(
+            response = await self.model.generate_content_async(
                 prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=temperature,
-                    max_output_tokens=400,  # Reduced to save quota
-                    top_p=0.8,
-                    top_k=40
-                )
+                generation_config=self._get_generation_config(temperature)
             )
             
             # Update token count
             self.daily_token_count += estimated_tokens
             self.consecutive_failures = 0  # Reset on success
+            self.circuit_breaker.record_success()
             
-            # Cache the response
-            response_text = response.text
+            # Clean up once before caching so cache hits return the final text
+            response_text = response.text.strip()
+            # Remove any "Bestie:" prefix if the model added it
+            if response_text.startswith("Bestie:"):
+                response_text = response_text[7:].lstrip()
             self._cache_response(cache_key, response_text)
             
-            print(f"✅ Gemini API success. Tokens used: ~{estimated_tokens}, Daily total: {self.daily_token_count}")
+            logger.info("Gemini API success. Tokens used: ~%d, daily total: %d", estimated_tokens, self.daily_token_count)
             
             return response_text
             
         except Exception as e:
             error_str = str(e)
-            print(f"Error generating response: {error_str}")
+            logger.error("Error generating response: %s", error_str)
+            self.circuit_breaker.record_failure()
             
             # Handle rate limit errors specifically
             if "quota" in error_str.lower() or "429" in error_str or "rate" in error_str.lower():
@@ -206,71 +468,46 @@ class GeminiService:
     
     def _generate_fallback_response(self, prompt: str) -> str:
         """Generate an intelligent fallback response when AI is not available"""
-        import random
-        
-        prompt_lower = prompt.lower()
-        
-        # Multi-language anxiety responses (first-aid with coping strategies)
-        if any(word in prompt_lower for word in ['anxious', 'worried', 'panic', 'overwhelmed', 'stressed', 'चिंता', 'परेशान', 'تناؤ', 'tension']):
-            responses = [
-                "Yaar, I can tell you're feeling anxious right now. Let's try this first-aid technique: Take 4 deep breaths - in for 4, hold for 4, out for 4. What's causing this stress, bro?",
-                "Bhai, anxiety feels overwhelming na? Try the 5-4-3-2-1 technique: Name 5 things you see, 4 you can touch, 3 you hear, 2 you smell, 1 you taste. Kya specific thing is worrying you?",
-                "Dude, that anxiety is real but manageable. Quick tip: Put your hand on your chest, feel your heartbeat, breathe with it. Now tell me what's the main stressor?",
-                "Hey yaar, anxiety attack? Try cold water on your wrists or drink some water slowly. Main hoon na - what's weighing heavy on your mind right now?"
-            ]
-            return random.choice(responses)
-        
-        # Multi-language sadness responses (first-aid with coping strategies)
-        elif any(word in prompt_lower for word in ['sad', 'depressed', 'down', 'hopeless', 'empty', 'उदास', 'दुखी', 'غمگین', 'udaas']):
-            responses = [
-                "Bro, sounds like you're going through a tough time. Quick first-aid: Try to get some sunlight or bright light, even for 10 minutes. Your feelings are valid - what's been happening?",
-                "Yaar, I can hear you're struggling. First-aid tip: Do one small thing you normally enjoy - chai, music, calling a friend. Kab se feeling this way?",
-                "Bhai, those heavy feelings are real. Try this: Write down 3 small things you're grateful for today. Main yahan hoon - what's been the hardest part?",
-                "Dude, when feeling low, movement helps - even 5 minutes walking. Your feelings matter, no judgment here. Kya specifically going on?"
-            ]
-            return random.choice(responses)
-        
-        # Academic stress (first-aid with study coping strategies)
-        elif any(word in prompt_lower for word in ['study', 'exam', 'academic', 'pressure', 'grades', 'पढ़ाई', 'امتحان', 'padhai', 'imtihaan']):
-            responses = [
-                "Yaar, academic pressure is real. First-aid tip: Break your study into 25-min chunks with 5-min breaks (Pomodoro). Your worth isn't your grades, bro. Which subject is stressing you most?",
-                "Bhai, exam stress is tough! Try this: Study for 45 mins, then do something fun for 15 mins. You're doing your best - what's the biggest challenge abhi?",
-                "Dude, study pressure getting to you? Quick tip: Make a simple today-only to-do list with just 3 tasks. Sab students feel this - what would help you feel more prepared?",
-                "Bro, studies overwhelming you? Try the 2-minute rule: If it takes less than 2 mins, do it now. You're more than your marks - kya specifically bothering you?"
-            ]
-            return random.choice(responses)
-        
-        # General supportive responses (bro style with multilingual)
-        else:
-            responses = [
-                "Thanks for sharing that with me, yaar. Your feelings are completely valid. What's been on your mind lately?",
-                "Bro, I can hear this is important to you. What would be most helpful to talk about right now?",
-                "Takes courage to reach out, dude. I'm glad you're here. Kaisa feeling today?",
-                "Yaar, that sounds like a lot to handle. What's been the most challenging part for you?",
-                "I'm here to listen and support you, bhai. What's weighing on your dil right now?",
-                "That sounds tough to deal with, bro. You don't have to face this alone. Kya chal raha hai?",
-                "Hey yaar, main sun raha hoon. Whatever it is, we can talk through it. What's going on?"
-            ]
-            return random.choice(responses)
-    
-    async def generate_response_async(self, prompt: str, temperature: float = 0.7) -> str:
-        """Async version of generate_response"""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self.generate_response, prompt, temperature)
+        found = {match.lastgroup for match in _FALLBACK_RE.finditer(prompt)}
+        
+        # Anxiety beats sadness beats academic stress when several match
+        for category in _FALLBACK_KEYWORDS:
+            if category in found:
+                return _choice(_FALLBACK_RESPONSES[category])
+        
+        return _choice(_GENERAL_RESPONSES)
+
+# Bestie persona preamble, identical for every message
+_BESTIE_SYSTEM_PROMPT = "\n".join([
+    "You are Bestie, an AI-guided first-aid mental health support companion for students.",
+    "Role: Provide immediate emotional first-aid, practical coping strategies, and refer to professionals when needed.",
+    "Personality: Supportive bro who's got your back - understanding, real, and helpful with practical solutions.",
+    "Language: Mix English, Hindi, Hinglish, Urdu, Roman Urdu naturally. Use bro terms like 'bhai', 'yaar', 'dude', 'bro'.",
+    "First-Aid Focus: Offer 1-2 practical coping strategies, validate feelings, provide immediate support.",
+    "Boundaries: You're first-aid support, not therapy. Refer to counselors for complex issues. Never diagnose."
+])
+
+# Full chat prompt; {context} is empty or the topic/history block wrapped in blank lines
+_BESTIE_PROMPT_TEMPLATE = _BESTIE_SYSTEM_PROMPT + "\n{context}\nUser: {message}\n\nBestie: "
 
 class BestieService:
     """Service for Bestie chatbot functionality"""
     
     def __init__(self):
-        self.gemini_service = GeminiService()
+        self.gemini_service = gemini_service
+        self.temperature = 0.7
     
-    async def process_message(self, message: str, history: List[Dict], user_id: Optional[str] = None, topic: Optional[str] = None) -> Dict[str, Any]:
+    async def process_message(self, message: str, history: List[Dict], user_id: Optional[str] = None, topic: Optional[str] = None, analysis: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
-        Process a user message and generate appropriate response
+        Process a user message and generate appropriate response.
+        `analysis` is a SafetyService.analyze result for `message`, if the caller already has one.
         """
         try:
-            # Validate message
-            validation = safety_service.validate_message(message)
+            # Validate and check for crisis indicators in one pass; both are microseconds of
+            # work, cheaper inline than a worker-thread hop
+            if analysis is None:
+                analysis = safety_service.analyze(message)
+            validation = analysis["validation"]
             if not validation["is_valid"]:
                 return {
                     "type": "error",
@@ -279,14 +516,13 @@ class BestieService:
                 }
             
             message = validation["sanitized_text"]
-            
-            # Check for crisis indicators
-            crisis_detection = safety_service.detect_crisis(message)
+            crisis_detection = analysis["crisis"]
             if crisis_detection["is_crisis"]:
                 return await self._handle_crisis_response(crisis_detection)
             
-            # Generate response using simplified approach
-            response = await self._generate_simple_response(message, history, topic)
+            # Generate response using simplified approach; generate_response probes the cache
+            prompt = self._build_prompt(message, history, topic)
+            response = await self._generate_simple_response(message, prompt)
             
             return {
                 "response": response,
@@ -302,7 +538,7 @@ class BestieService:
             }
             
         except Exception as e:
-            print(f"Error processing message: {e}")
+            logger.exception("Error processing message")
             return {
                 "response": "Hey yaar, I'm your first-aid mental health bro. Sometimes my connection acts up, but I'm still here for you. Take a deep breath with me - what's going on today?",
                 "agent": "listener",
@@ -311,10 +547,8 @@ class BestieService:
                 "metadata": {"error": str(e)}
             }
     
-    async def _generate_simple_response(self, message: str, history: List[Dict], topic: Optional[str]) -> str:
-        """Generate response using simplified approach that works with Gemini"""
-        
-        # Create a simple, direct prompt without system roles
+    def _build_prompt(self, message: str, history: List[Dict], topic: Optional[str]) -> str:
+        """Build a simple, direct prompt without system roles"""
         context_lines = []
         
         # Add topic context if available
@@ -329,39 +563,18 @@ class BestieService:
                 content = msg.get("content", "")
                 context_lines.append(f"{role}: {content}")
         
-        # Build the complete prompt
-        prompt_parts = [
-            "You are Bestie, an AI-guided first-aid mental health support companion for students.",
-            "Role: Provide immediate emotional first-aid, practical coping strategies, and refer to professionals when needed.",
-            "Personality: Supportive bro who's got your back - understanding, real, and helpful with practical solutions.",
-            "Language: Mix English, Hindi, Hinglish, Urdu, Roman Urdu naturally. Use bro terms like 'bhai', 'yaar', 'dude', 'bro'.",
-            "First-Aid Focus: Offer 1-2 practical coping strategies, validate feelings, provide immediate support.",
-            "Boundaries: You're first-aid support, not therapy. Refer to counselors for complex issues. Never diagnose."
-        ]
-        
-        if context_lines:
-            prompt_parts.append("\n" + "\n".join(context_lines))
-        
-        prompt_parts.append(f"\nUser: {message}")
-        prompt_parts.append("\nBestie: ")
-        
-        full_prompt = "\n".join(prompt_parts)
-        
+        # Build the complete prompt: fixed template, only the dynamic fields substituted
+        context = "\n" + "\n".join(context_lines) + "\n" if context_lines else ""
+        return _BESTIE_PROMPT_TEMPLATE.format_map({"context": context, "message": message})
+    
+    async def _generate_simple_response(self, message: str, prompt: str) -> str:
+        """Generate response using simplified approach that works with Gemini"""
         try:
             # Use the Gemini service to generate response
-            response = await self.gemini_service.generate_response_async(full_prompt, temperature=0.7)
-            
-            # Clean up the response
-            response = response.strip()
-            
-            # Remove any "Bestie:" prefix if the model added it
-            if response.startswith("Bestie:"):
-                response = response[7:].strip()
-            
-            return response
+            return await self.gemini_service.generate_response(prompt, temperature=self.temperature)
             
-        except Exception as e:
-            print(f"Error in simple response generation: {e}")
+        except Exception:
+            logger.exception("Error in simple response generation")
             return self.gemini_service._generate_fallback_response(message)
     
     async def _handle_crisis_response(self, crisis_detection: Dict[str, Any]) -> Dict[str, Any]:
@@ -407,14 +620,58 @@ You're not alone in this, and there are people who want to help."""
             }
         }
 
+# Rule-based moderation stems, matched at a word start with any ending so inflected
+# forms ("killing", "suicidal", "attacks") hit too; "die" is spelled out so "diet" doesn't
+_TOXIC_RE = re.compile(
+    r"\b(?:(?:" + "|".join([
+        "hate", "kill", "abuse", "fuck", "shit", "bitch", "asshole",
+        "suicid", "harm", "violen", "threat", "bomb", "attack"
+    ]) + r")\w*|di(?:e|es|ed)\b|dying\b)",
+    re.IGNORECASE
+)
+
+# First flat JSON object in a moderation reply
+_JSON_OBJECT_RE = re.compile(rb"\{[^{}]*\}")
+
 class ModerationService:
     """Service for content moderation using AI"""
     
     def __init__(self):
-        self.gemini_service = GeminiService()
+        self.gemini_service = gemini_service
+        
+        # Gemini decisions keyed by normalized text (forum posts repeat a lot)
+        self.decision_cache = TTLCache(maxsize=10000, ttl=3600)
+        self.max_cached_text_length = 500
+        
+        # Short posts that pass the keyword and crisis checks are allowed without asking Gemini
+        self.short_text_length = 40
+    
+    def _decision_cache_key(self, text: str) -> Optional[str]:
+        """Cache key for a post, or None for long posts that are unlikely to repeat"""
+        normalized = text.strip().lower()
+        if len(normalized) > self.max_cached_text_length:
+            return None
+        return hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
     
     async def moderate_post(self, text: str) -> Dict[str, Any]:
         """Moderate forum post content"""
+        # Rule-based check first. A keyword hit is only ambiguous ("panic attack", "my dog
+        # died"), so it goes to Gemini and the rule-based block is kept for when Gemini fails;
+        # only short posts with no hit and no crisis signal skip the Gemini call
+        rule_based = self._fallback_moderation(text)
+        if (
+            rule_based["decision"] == "allow"
+            and len(text.strip()) < self.short_text_length
+            and not safety_service.detect_crisis(text)["is_crisis"]
+        ):
+            return rule_based
+        
+        cache_key = self._decision_cache_key(text)
+        if cache_key is not None:
+            cached_decision = self.decision_cache.get(cache_key)
+            if cached_decision is not None:
+                return dict(cached_decision)
+        
         try:
             # Simplified moderation prompt
             prompt = f"""Analyze this text for a student mental health forum:
@@ -424,31 +681,36 @@ class ModerationService:
 Is this appropriate? Consider: toxicity, self-harm promotion, harassment.
 Respond ONLY with JSON: {{"decision": "allow" or "block", "confidence": 0.0-1.0, "reason": "brief explanation"}}"""
             
-            response = await self.gemini_service.generate_response_async(prompt, temperature=0.2)
+            response = await self.gemini_service.generate_response(prompt, temperature=0.2)
+            
+            # Gemini sometimes wraps the JSON in prose or code fences; parse only the object
+            match = _JSON_OBJECT_RE.search(response.encode())
+            if match is None:
+                return self._fallback_moderation(text)
             
             try:
-                moderation_result = json.loads(response.strip())
-                return {
+                moderation_result = orjson.loads(match.group(0))
+                decision = {
                     "decision": moderation_result.get("decision", "allow"),
                     "confidence": moderation_result.get("confidence", 0.5),
                     "reason": moderation_result.get("reason", "AI moderation analysis"),
                     "method": "gemini"
                 }
-            except json.JSONDecodeError:
+                # Only Gemini decisions are cached; rule-based fallbacks are cheap and
+                # should be retried against Gemini once it recovers
+                if cache_key is not None:
+                    self.decision_cache[cache_key] = decision
+                return dict(decision)
+            except orjson.JSONDecodeError:
                 return self._fallback_moderation(text)
             
-        except Exception as e:
-            print(f"Error in AI moderation: {e}")
+        except Exception:
+            logger.exception("Error in AI moderation")
             return self._fallback_moderation(text)
     
     def _fallback_moderation(self, text: str) -> Dict[str, Any]:
         """Fallback moderation using rule-based approach"""
-        toxic_keywords = [
-            "hate", "kill", "die", "abuse", "fuck", "shit", "bitch", "asshole",
-            "suicide", "harm", "violence", "threat", "bomb", "attack"
-        ]
-        
-        if any(kw in text.lower() for kw in toxic_keywords):
+        if _TOXIC_RE.search(text):
             return {
                 "decision": "block",
                 "confidence": 0.8,
@@ -464,5 +726,7 @@ Respond ONLY with JSON: {{"decision": "allow" or "block", "confidence": 0.0-1.0,
             }
 
 # Create service instances
+# One client shared by both services so rate limits, backoff and cache track the single real quota
+gemini_service = GeminiService()
 bestie_service = BestieService()
 moderation_service = ModerationService()
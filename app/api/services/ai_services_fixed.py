@@ -1,13 +1,97 @@
 import google.generativeai as genai
 from typing import List, Dict, Any, Optional
-import json
+import re
 import asyncio
 import time
+import random
 import hashlib
+import struct
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from datetime import datetime, timedelta
+import orjson
 from app.core.config import settings
 from app.core.security import safety_service
 
+# Fallback keyword triggers, one case-insensitive alternation per category.
+# Plain substring matching like the original `in` checks; splitting into \w tokens
+# would break Devanagari words at their combining marks.
+def _keyword_pattern(words) -> re.Pattern:
+    return re.compile("|".join(map(re.escape, words)), re.IGNORECASE)
+
+_ANXIETY_RE = _keyword_pattern(['anxious', 'worried', 'panic', 'overwhelmed', 'stressed', 'चिंता', 'परेशान', 'تناؤ'])
+_SADNESS_RE = _keyword_pattern(['sad', 'depressed', 'down', 'hopeless', 'empty', 'उदास', 'दुखी', 'غمگین'])
+_STUDY_RE = _keyword_pattern(['study', 'exam', 'academic', 'pressure', 'grades', 'पढ़ाई', 'امتحان'])
+
+# Multi-language anxiety responses
+_ANXIETY_RESPONSES = (
+    "I can sense you're feeling anxious right now. That's completely normal. Try taking a few deep breaths. What's weighing on your mind?",
+    "Anxiety can feel overwhelming, but you're not alone in this. What's been causing you the most stress lately?",
+    "That sounds really stressful. Many students go through this. What would help you feel more calm right now?",
+)
+
+# Multi-language sadness responses
+_SADNESS_RESPONSES = (
+    "It sounds like you're going through a really tough time. Those feelings are valid, and you matter. What's been going on?",
+    "I hear that you're struggling right now. That takes courage to share. How long have you been feeling this way?",
+    "That sounds incredibly difficult. You don't have to face this alone. What's been the hardest part?",
+)
+
+# Academic stress
+_STUDY_RESPONSES = (
+    "Academic pressure can feel overwhelming. Remember, your worth isn't defined by grades. What specific part is stressing you most?",
+    "Student life can be really demanding. You're doing your best, and that matters. What's the biggest challenge right now?",
+    "Exam stress is so real. Many students feel this way. What would help you feel more prepared or calm?",
+)
+
+# General supportive responses with variety
+_GENERAL_RESPONSES = (
+    "Thanks for sharing that with me. Your feelings are completely valid. What's been on your mind lately?",
+    "I can hear this is important to you. What would be most helpful to talk about right now?",
+    "It takes courage to reach out. I'm glad you're here. How are you feeling today?",
+    "That sounds like a lot to handle. What's been the most challenging part for you?",
+    "I'm here to listen and support you. What's weighing on your heart right now?",
+    "That sounds tough to deal with. You don't have to face this alone. What's going on?",
+)
+
+_FALLBACK_RESPONSES = {
+    "anxiety": _ANXIETY_RESPONSES,
+    "sadness": _SADNESS_RESPONSES,
+    "study": _STUDY_RESPONSES,
+    "general": _GENERAL_RESPONSES,
+}
+
+
+@lru_cache(maxsize=2048)
+def _classify_fallback(message: str) -> str:
+    """Map a user message to its fallback response category (first matching category wins)"""
+    if _ANXIETY_RE.search(message):
+        return "anxiety"
+    if _SADNESS_RE.search(message):
+        return "sadness"
+    if _STUDY_RE.search(message):
+        return "study"
+    return "general"
+
+
+def _user_message(prompt: str) -> str:
+    """Pull the latest user turn out of a Bestie prompt (the whole prompt if it has none)"""
+    # Classifying only this turn keeps the cache key short and stops the cache from
+    # holding on to conversation history, which differs on every call anyway
+    _, sep, tail = prompt.rpartition("User: ")
+    if not sep:
+        return prompt
+    return tail.split("\n\nBestie:", 1)[0]
+
+# Fixed Bestie instructions, prepended to every prompt
+_BESTIE_SYSTEM = (
+    "You are Bestie, a warm and empathetic mental health support chatbot for students.\n"
+    "Guidelines: Be supportive, validate feelings naturally, respond in 1-3 sentences, ask follow-up questions when helpful.\n"
+    "Never diagnose or give medical advice. Refer to professionals for serious issues."
+)
+
+
 class GeminiService:
     """Service for interacting with Google Gemini AI with rate limiting and caching"""
     
@@ -18,17 +102,22 @@ class GeminiService:
         # Rate limiting (Gemini free tier: 15 RPM)
         self.requests_per_minute = 10  # Conservative limit
         self.max_tokens_per_day = 50000  # Conservative daily limit
-        self.request_timestamps = []
+        # Token bucket: holds up to requests_per_minute tokens, refilled continuously
+        self.tokens = float(self.requests_per_minute)
+        self.last_refill = time.monotonic()
         self.daily_token_count = 0
-        self.last_reset_date = datetime.now().date()
+        self.next_daily_reset = self._next_midnight()  # wall-clock epoch seconds
         
         # Caching for similar requests
-        self.response_cache = {}
+        self.response_cache = OrderedDict()  # LRU order: least recently used first
         self.cache_ttl = 3600  # 1 hour cache TTL
         
-        # Backoff strategy
+        # Backoff strategy (backoff_until is a time.monotonic() deadline)
         self.backoff_until = None
         self.consecutive_failures = 0
+        
+        # generate_response runs on executor threads; guards the cache and rate-limit state above
+        self._lock = threading.Lock()
     
     def _initialize_model(self):
         """Initialize the Gemini model"""
@@ -45,99 +134,124 @@ class GeminiService:
             print(f"❌ Failed to initialize Gemini model: {e} - running in fallback mode")
             self.model = None
     
+    @staticmethod
+    def _next_midnight() -> float:
+        """Epoch seconds of the next local midnight"""
+        tomorrow = datetime.now().date() + timedelta(days=1)
+        return datetime.combine(tomorrow, datetime.min.time()).timestamp()
+    
+    def _refill_tokens(self):
+        """Add the tokens earned since the last refill, capped at one minute's worth"""
+        now = time.monotonic()
+        self.tokens = min(
+            self.requests_per_minute,
+            self.tokens + (now - self.last_refill) * (self.requests_per_minute / 60.0)
+        )
+        self.last_refill = now
+    
     def _check_rate_limit(self) -> bool:
         """Check if we can make an API request based on rate limits"""
-        now = datetime.now()
-        
-        # Reset daily counter if new day
-        if now.date() > self.last_reset_date:
-            self.daily_token_count = 0
-            self.last_reset_date = now.date()
-            print(f"🔄 Daily token counter reset")
-        
-        # Check if we're in backoff period
-        if self.backoff_until and now < self.backoff_until:
-            remaining = (self.backoff_until - now).seconds
-            print(f"⏳ In backoff period, {remaining} seconds remaining")
-            return False
-        
-        # Clean old timestamps (keep only last minute)
-        cutoff = now - timedelta(minutes=1)
-        self.request_timestamps = [ts for ts in self.request_timestamps if ts > cutoff]
-        
-        # Check RPM limit
-        if len(self.request_timestamps) >= self.requests_per_minute:
-            print(f"⚠️ Rate limit exceeded: {len(self.request_timestamps)}/{self.requests_per_minute} RPM")
-            return False
-        
-        return True
+        with self._lock:
+            now = time.monotonic()
+            
+            # Reset daily counter if new day
+            if time.time() >= self.next_daily_reset:
+                self.daily_token_count = 0
+                self.next_daily_reset = self._next_midnight()
+                print(f"🔄 Daily token counter reset")
+            
+            # Check if we're in backoff period
+            if self.backoff_until and now < self.backoff_until:
+                remaining = int(self.backoff_until - now)
+                print(f"⏳ In backoff period, {remaining} seconds remaining")
+                return False
+            
+            # Take a token for this request if one is available
+            self._refill_tokens()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+        
+        print(f"⚠️ Rate limit exceeded: {self.requests_per_minute} RPM")
+        return False
     
-    def _get_cache_key(self, prompt: str, temperature: float) -> str:
+    def _get_cache_key(self, prompt: str, temperature: float) -> bytes:
         """Generate cache key for the request"""
-        # Create hash of prompt + temperature for caching
-        content = f"{prompt}_{temperature}"
-        return hashlib.md5(content.encode()).hexdigest()
+        # Hash prompt + temperature; the raw 16-byte digest is used directly as the dict key
+        h = hashlib.blake2b(digest_size=16)
+        h.update(prompt.encode())
+        h.update(struct.pack('<d', temperature))
+        return h.digest()
     
-    def _get_cached_response(self, cache_key: str) -> Optional[str]:
+    def _get_cached_response(self, cache_key: bytes) -> Optional[str]:
         """Get cached response if available and not expired"""
-        if cache_key not in self.response_cache:
-            return None
-        
-        cached_data = self.response_cache[cache_key]
-        if datetime.now() - cached_data['timestamp'] > timedelta(seconds=self.cache_ttl):
-            # Cache expired
-            del self.response_cache[cache_key]
-            return None
-        
+        with self._lock:
+            cached_data = self.response_cache.get(cache_key)
+            if cached_data is None:
+                return None
+            
+            if time.monotonic() - cached_data['timestamp'] > self.cache_ttl:
+                # Cache expired
+                del self.response_cache[cache_key]
+                return None
+            
+            self.response_cache.move_to_end(cache_key)
         print(f"💾 Using cached response for request")
         return cached_data['response']
     
-    def _cache_response(self, cache_key: str, response: str):
+    def _cache_response(self, cache_key: bytes, response: str):
         """Cache the response"""
-        self.response_cache[cache_key] = {
-            'response': response,
-            'timestamp': datetime.now()
-        }
-        
-        # Limit cache size (keep last 100 entries)
-        if len(self.response_cache) > 100:
-            oldest_key = min(self.response_cache.keys(), 
-                           key=lambda k: self.response_cache[k]['timestamp'])
-            del self.response_cache[oldest_key]
+        with self._lock:
+            self.response_cache[cache_key] = {
+                'response': response,
+                'timestamp': time.monotonic()
+            }
+            self.response_cache.move_to_end(cache_key)
+            
+            # Limit cache size (keep the 100 most recently used entries)
+            if len(self.response_cache) > 100:
+                self.response_cache.popitem(last=False)
     
     def _handle_rate_limit_error(self, error: Exception):
         """Handle rate limit errors with intelligent backoff"""
-        self.consecutive_failures += 1
-        
-        # Extract retry delay from error message if available
-        error_str = str(error)
-        if "retry_delay" in error_str or "30" in error_str:
-            backoff_seconds = 35  # Add a bit extra to the suggested 30s
-        else:
-            # Exponential backoff: 2^failures * 30 seconds, max 10 minutes
-            backoff_seconds = min(2 ** self.consecutive_failures * 30, 600)
-        
-        self.backoff_until = datetime.now() + timedelta(seconds=backoff_seconds)
+        with self._lock:
+            self.consecutive_failures += 1
+            
+            # Extract retry delay from error message if available
+            error_str = str(error)
+            if "retry_delay" in error_str or "30" in error_str:
+                backoff_seconds = 35  # Add a bit extra to the suggested 30s
+            else:
+                # Exponential backoff: 2^failures * 30 seconds (max 10 minutes), jittered +/-50%
+                # so workers that hit the quota together don't retry together
+                base = min(2 ** self.consecutive_failures * 30, 600)
+                backoff_seconds = min(random.uniform(base * 0.5, base * 1.5), 600)
+            
+            self.backoff_until = time.monotonic() + backoff_seconds
         
-        print(f"🚫 Rate limit hit. Backing off for {backoff_seconds} seconds")
-        print(f"📊 API Usage Stats: RPM: {len(self.request_timestamps)}, Daily tokens: {self.daily_token_count}")
+        print(f"🚫 Rate limit hit. Backing off for {backoff_seconds:.1f} seconds")
+        print(f"📊 API Usage Stats: Tokens available: {self.tokens:.1f}/{self.requests_per_minute}, Daily tokens: {self.daily_token_count}")
     
     def get_api_status(self) -> Dict[str, Any]:
         """Get current API status and usage statistics"""
-        now = datetime.now()
+        with self._lock:
+            now = time.monotonic()
+            self._refill_tokens()
         
-        # Clean old timestamps
-        cutoff = now - timedelta(minutes=1)
-        self.request_timestamps = [ts for ts in self.request_timestamps if ts > cutoff]
+        # backoff_until is monotonic; convert to wall clock only for display
+        backoff_until = None
+        if self.backoff_until:
+            backoff_until = datetime.fromtimestamp(time.time() + self.backoff_until - now).isoformat()
         
         return {
             "api_key_configured": self.model is not None,
-            "requests_this_minute": len(self.request_timestamps),
+            "requests_this_minute": round(self.requests_per_minute - self.tokens),
+            "rate_limit_tokens_available": round(self.tokens, 2),
             "requests_per_minute_limit": self.requests_per_minute,
             "tokens_used_today": self.daily_token_count,
             "daily_token_limit": self.max_tokens_per_day,
             "in_backoff": self.backoff_until is not None and now < self.backoff_until,
-            "backoff_until": self.backoff_until.isoformat() if self.backoff_until else None,
+            "backoff_until": backoff_until,
             "consecutive_failures": self.consecutive_failures,
             "cache_size": len(self.response_cache),
             "quota_exhausted": self.daily_token_count >= self.max_tokens_per_day
@@ -160,11 +274,15 @@ class GeminiService:
                 print(f"⚠️ Rate limit exceeded, using fallback response")
                 return self._generate_fallback_response(prompt)
             
-            # Record request timestamp
-            self.request_timestamps.append(datetime.now())
-            
             # Estimate tokens (rough estimate: 1 token ≈ 4 characters)
-            estimated_tokens = len(prompt) // 4 + 150  # Add output tokens estimate
+            estimated_tokens = (len(prompt) >> 2) + 150  # Add output tokens estimate
+            
+            # Only pay for an exact count when the estimate puts us near the daily limit
+            if self.daily_token_count + estimated_tokens > 0.9 * self.max_tokens_per_day:
+                try:
+                    estimated_tokens = self.model.count_tokens(prompt).total_tokens + 150
+                except Exception as e:
+                    print(f"Token count failed, keeping estimate: {e}")
             
             # Check daily token limit
             if self.daily_token_count + estimated_tokens >= self.max_tokens_per_day:
@@ -183,8 +301,9 @@ class GeminiService:
             )
             
             # Update token count
-            self.daily_token_count += estimated_tokens
-            self.consecutive_failures = 0  # Reset on success
+            with self._lock:
+                self.daily_token_count += estimated_tokens
+                self.consecutive_failures = 0  # Reset on success
             
             # Cache the response
             response_text = response.text
@@ -206,48 +325,7 @@ class GeminiService:
     
     def _generate_fallback_response(self, prompt: str) -> str:
         """Generate an intelligent fallback response when AI is not available"""
-        import random
-        
-        prompt_lower = prompt.lower()
-        
-        # Multi-language anxiety responses
-        if any(word in prompt_lower for word in ['anxious', 'worried', 'panic', 'overwhelmed', 'stressed', 'चिंता', 'परेशान', 'تناؤ']):
-            responses = [
-                "I can sense you're feeling anxious right now. That's completely normal. Try taking a few deep breaths. What's weighing on your mind?",
-                "Anxiety can feel overwhelming, but you're not alone in this. What's been causing you the most stress lately?",
-                "That sounds really stressful. Many students go through this. What would help you feel more calm right now?"
-            ]
-            return random.choice(responses)
-        
-        # Multi-language sadness responses
-        elif any(word in prompt_lower for word in ['sad', 'depressed', 'down', 'hopeless', 'empty', 'उदास', 'दुखी', 'غمگین']):
-            responses = [
-                "It sounds like you're going through a really tough time. Those feelings are valid, and you matter. What's been going on?",
-                "I hear that you're struggling right now. That takes courage to share. How long have you been feeling this way?",
-                "That sounds incredibly difficult. You don't have to face this alone. What's been the hardest part?"
-            ]
-            return random.choice(responses)
-        
-        # Academic stress
-        elif any(word in prompt_lower for word in ['study', 'exam', 'academic', 'pressure', 'grades', 'पढ़ाई', 'امتحان']):
-            responses = [
-                "Academic pressure can feel overwhelming. Remember, your worth isn't defined by grades. What specific part is stressing you most?",
-                "Student life can be really demanding. You're doing your best, and that matters. What's the biggest challenge right now?",
-                "Exam stress is so real. Many students feel this way. What would help you feel more prepared or calm?"
-            ]
-            return random.choice(responses)
-        
-        # General supportive responses with variety
-        else:
-            responses = [
-                "Thanks for sharing that with me. Your feelings are completely valid. What's been on your mind lately?",
-                "I can hear this is important to you. What would be most helpful to talk about right now?",
-                "It takes courage to reach out. I'm glad you're here. How are you feeling today?",
-                "That sounds like a lot to handle. What's been the most challenging part for you?",
-                "I'm here to listen and support you. What's weighing on your heart right now?",
-                "That sounds tough to deal with. You don't have to face this alone. What's going on?"
-            ]
-            return random.choice(responses)
+        return random.choice(_FALLBACK_RESPONSES[_classify_fallback(_user_message(prompt))])
     
     async def generate_response_async(self, prompt: str, temperature: float = 0.7) -> str:
         """Async version of generate_response"""
@@ -265,8 +343,9 @@ class BestieService:
         Process a user message and generate appropriate response
         """
         try:
-            # Validate message
-            validation = safety_service.validate_message(message)
+            # Validate message and check for crisis indicators in one pass
+            analysis = safety_service.analyze(message)
+            validation = analysis["validation"]
             if not validation["is_valid"]:
                 return {
                     "type": "error",
@@ -276,8 +355,7 @@ class BestieService:
             
             message = validation["sanitized_text"]
             
-            # Check for crisis indicators
-            crisis_detection = safety_service.detect_crisis(message)
+            crisis_detection = analysis["crisis"]
             if crisis_detection["is_crisis"]:
                 return await self._handle_crisis_response(crisis_detection)
             
@@ -326,19 +404,8 @@ class BestieService:
                 context_lines.append(f"{role}: {content}")
         
         # Build the complete prompt
-        prompt_parts = [
-            "You are Bestie, a warm and empathetic mental health support chatbot for students.",
-            "Guidelines: Be supportive, validate feelings naturally, respond in 1-3 sentences, ask follow-up questions when helpful.",
-            "Never diagnose or give medical advice. Refer to professionals for serious issues."
-        ]
-        
-        if context_lines:
-            prompt_parts.append("\n" + "\n".join(context_lines))
-        
-        prompt_parts.append(f"\nUser: {message}")
-        prompt_parts.append("\nBestie: ")
-        
-        full_prompt = "\n".join(prompt_parts)
+        context = "\n\n" + "\n".join(context_lines) if context_lines else ""
+        full_prompt = f"{_BESTIE_SYSTEM}{context}\n\nUser: {message}\n\nBestie: "
         
         try:
             # Use the Gemini service to generate response
@@ -400,14 +467,37 @@ You're not alone in this, and there are people who want to help."""
             }
         }
 
+# Rule-based moderation stems, matched at a word start with any ending so inflected
+# forms ("killing", "suicidal", "attacks") hit too; "die" is spelled out so "diet" doesn't
+_TOXIC_RE = re.compile(
+    r"\b(?:(?:" + "|".join([
+        "hate", "kill", "abuse", "fuck", "shit", "bitch", "asshole",
+        "suicid", "harm", "violen", "threat", "bomb", "attack"
+    ]) + r")\w*|di(?:e|es|ed)\b|dying\b)",
+    re.IGNORECASE
+)
+
+# First flat JSON object in a moderation reply
+_JSON_OBJECT_RE = re.compile(rb"\{[^{}]*\}")
+
 class ModerationService:
     """Service for content moderation using AI"""
     
     def __init__(self):
         self.gemini_service = GeminiService()
+        
+        # Parsed Gemini decisions for recently seen posts (LRU, identical posts repeat a lot)
+        self._mod_cache = OrderedDict()
+        self._mod_cache_size = 512
     
     async def moderate_post(self, text: str) -> Dict[str, Any]:
         """Moderate forum post content"""
+        cache_key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+        cached_decision = self._mod_cache.get(cache_key)
+        if cached_decision is not None:
+            self._mod_cache.move_to_end(cache_key)
+            return dict(cached_decision)
+        
         try:
             # Simplified moderation prompt
             prompt = f"""Analyze this text for a student mental health forum:
@@ -419,15 +509,26 @@ Respond ONLY with JSON: {{"decision": "allow" or "block", "confidence": 0.0-1.0,
             
             response = await self.gemini_service.generate_response_async(prompt, temperature=0.2)
             
+            # Gemini sometimes wraps the JSON in prose or code fences; parse only the object
+            match = _JSON_OBJECT_RE.search(response.encode())
+            if match is None:
+                return self._fallback_moderation(text)
+            
             try:
-                moderation_result = json.loads(response.strip())
-                return {
+                moderation_result = orjson.loads(match.group(0))
+                decision = {
                     "decision": moderation_result.get("decision", "allow"),
                     "confidence": moderation_result.get("confidence", 0.5),
                     "reason": moderation_result.get("reason", "AI moderation analysis"),
                     "method": "gemini"
                 }
-            except json.JSONDecodeError:
+                # Only Gemini decisions are cached; rule-based fallbacks should be
+                # retried against Gemini once it recovers
+                self._mod_cache[cache_key] = decision
+                if len(self._mod_cache) > self._mod_cache_size:
+                    self._mod_cache.popitem(last=False)
+                return dict(decision)
+            except orjson.JSONDecodeError:
                 return self._fallback_moderation(text)
             
         except Exception as e:
@@ -436,12 +537,7 @@ Respond ONLY with JSON: {{"decision": "allow" or "block", "confidence": 0.0-1.0,
     
     def _fallback_moderation(self, text: str) -> Dict[str, Any]:
         """Fallback moderation using rule-based approach"""
-        toxic_keywords = [
-            "hate", "kill", "die", "abuse", "fuck", "shit", "bitch", "asshole",
-            "suicide", "harm", "violence", "threat", "bomb", "attack"
-        ]
-        
-        if any(kw in text.lower() for kw in toxic_keywords):
+        if _TOXIC_RE.search(text):
             return {
                 "decision": "block",
                 "confidence": 0.8,
@@ -1,56 +1,48 @@
 # services/analytics.py
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import io
 import asyncio
+import logging
 from typing import List, Optional, Dict, Any
 from datetime import datetime
-from app.api.crud.patient_crud import get_patient_metrics, get_students_of_counselor, get_session_titles
-from app.core.db import get_db
+from app.api.crud.patient_crud import get_counselor_metrics
 
-plt.switch_backend("Agg")  # non-GUI backend
+logger = logging.getLogger(__name__)
 
 # helper to build dataframe from metrics records
+METRIC_COLUMNS = ["patient_id", "timestamp", "happiness", "phq9_score", "gad7_score", "session_title"]
+SCORE_COLUMNS = ["happiness", "phq9", "gad7"]
+
 def records_to_df(records: List[dict]) -> pd.DataFrame:
     # records expected to contain fields: patient_id, timestamp, happiness (0-100), phq9.score, gad7.score, session_title
     if not records:
         return pd.DataFrame()
-    normalized = []
-    for r in records:
-        row = {
-            "patient_id": r.get("patient_id"),
-            "timestamp": r.get("timestamp"),
-            "happiness": r.get("happiness", None),
-            "phq9": r.get("phq9_score", None),
-            "gad7": r.get("gad7_score", None),
-            "session_title": r.get("session_title", None)
-        }
-        normalized.append(row)
-    df = pd.DataFrame(normalized)
-    if not df.empty:
-        df["timestamp"] = pd.to_datetime(df["timestamp"])
+    # missing fields come through as NaN; unknown fields are dropped
+    df = pd.DataFrame.from_records(records, columns=METRIC_COLUMNS)
+    df.rename(columns={"phq9_score": "phq9", "gad7_score": "gad7"}, inplace=True)
+    raw_timestamps = df["timestamp"]
+    df["timestamp"] = pd.to_datetime(raw_timestamps, format="ISO8601", utc=True, errors="coerce")
+    # unparseable timestamps become NaT and fall out of the daily groups; say so
+    unparsed = int((df["timestamp"].isna() & raw_timestamps.notna()).sum())
+    if unparsed:
+        logger.warning("Ignoring %d of %d metric records with unparseable timestamps", unparsed, len(df))
+    # float64, not float32: the means end up in JSON, where float32 shows as 3.700000047
+    df[SCORE_COLUMNS] = df[SCORE_COLUMNS].astype("float64")
+    # string dtype even when every title is missing, so .str always works
+    df["session_title"] = df["session_title"].astype("string")
     return df
 
 # asynchronous wrapper to run blocking pandas/matplotlib in thread
-async def compute_counselor_analytics(counselor_id: str, start: Optional[datetime], end: Optional[datetime]) -> Dict[str, Any]:
-    # acquire db instance
-    db = None
-    async for _db in get_db():
-        db = _db
-        break
+async def compute_counselor_analytics(db, counselor_id: str, start: Optional[datetime], end: Optional[datetime]) -> Dict[str, Any]:
+    # db is resolved by the route's Depends(get_db)
     if db is None:
         return {"error": "DB not available"}
 
-    # get list of students
-    patient_ids = await get_students_of_counselor(db, counselor_id)
-    # fetch metrics for each student
-    tasks = [get_patient_metrics(db, pid, start, end) for pid in patient_ids]
-    all_records_lists = await asyncio.gather(*tasks)
-    # flatten and include patient_id
-    combined = []
-    for lst in all_records_lists:
-        combined.extend(lst)
+    # students and their metrics in a single aggregation round trip
+    combined = await get_counselor_metrics(db, counselor_id, start, end)
     # Run heavy computation in thread
     result = await asyncio.to_thread(_compute_analytics_sync, combined)
     return result
@@ -61,47 +53,55 @@ def _compute_analytics_sync(records: List[dict]) -> Dict[str, Any]:
     if df.empty:
         return out
     out["student_count"] = df["patient_id"].nunique()
+    has_happiness = df["happiness"].notna().any()
     # compute happiness over time: group by date
-    df["date"] = df["timestamp"].dt.date
-    daily = df.groupby("date").agg({"happiness": "mean"}).reset_index()
-    # Create a line plot for daily happiness average
-    buf = io.BytesIO()
-    plt.figure(figsize=(8,4))
-    plt.plot(daily["date"], daily["happiness"], marker="o")
-    plt.title("Average Happiness Over Time")
-    plt.xlabel("Date")
-    plt.ylabel("Avg happiness")
-    plt.grid(True)
-    plt.tight_layout()
-    plt.savefig(buf, format="png")
-    plt.close()
-    buf.seek(0)
-    out["charts"]["happiness_trend_png"] = buf.getvalue()
+    # nothing to plot when no reading has a happiness value, so skip matplotlib entirely
+    if has_happiness:
+        # day-truncate in numpy instead of building a Python date object per row
+        df["date"] = df["timestamp"].values.astype("datetime64[D]")
+        daily = df.groupby("date")["happiness"].mean().reset_index()
+        # Create a line plot for daily happiness average
+        # Figure + Agg canvas directly: no pyplot global state, safe in worker threads
+        buf = io.BytesIO()
+        fig = Figure(figsize=(8,4))
+        ax = fig.subplots()
+        ax.plot(daily["date"], daily["happiness"], marker="o")
+        ax.set_title("Average Happiness Over Time")
+        ax.set_xlabel("Date")
+        ax.set_ylabel("Avg happiness")
+        ax.grid(True)
+        fig.tight_layout()
+        FigureCanvasAgg(fig).print_png(buf)
+        # getvalue() hands over BytesIO's own buffer when nothing else references it, so no extra copy
+        out["charts"]["happiness_trend_png"] = buf.getvalue()
+    else:
+        out["charts"]["happiness_trend_png"] = b""
 
     # compute session_title vs happiness change
     # For each session_title, compute mean happiness after that session for patients with that title
     # We approximate: group by session_title and compute avg happiness
-    df_title = df.dropna(subset=["session_title", "happiness"])
-    title_stats = df_title.groupby("session_title").agg({"happiness": ["mean", "count"]})
-    title_stats.columns = ["happiness_mean", "count"]
-    title_stats = title_stats.reset_index().sort_values("happiness_mean", ascending=False)
-    out["title_stats"] = title_stats.head(20).to_dict(orient="records")
+    # count only counts rows with a happiness value; titles without any are dropped
+    if has_happiness and df["session_title"].notna().any():
+        title_stats = df.groupby("session_title", sort=False, dropna=True)["happiness"].agg(["mean", "count"])
+        title_stats.columns = ["happiness_mean", "count"]
+        title_stats = title_stats[title_stats["count"] > 0].reset_index().sort_values("happiness_mean", ascending=False)
+        out["title_stats"] = title_stats.head(20).to_dict(orient="records")
+    else:
+        out["title_stats"] = []
 
     # Example auto-insight: compute percentage of students with session_title == 'panic attacks' whose average happiness increased
     # naive approach: for each patient with that title, compare earliest vs latest happiness
     insights = []
-    if "panic" in " ".join(df_title["session_title"].astype(str).unique()).lower():
-        # find patients with session_title containing 'panic'
-        panic_mask = df_title["session_title"].str.contains("panic", case=False, na=False)
-        panic_patients = df_title.loc[panic_mask, "patient_id"].unique()
-        improved = 0
+    # rated rows whose session_title contains 'panic'; the same mask gates and selects
+    panic_mask = df["session_title"].str.contains("panic", case=False, na=False, regex=False) & df["happiness"].notna()
+    if panic_mask.any():
+        panic_patients = df.loc[panic_mask, "patient_id"].unique()
         total = len(panic_patients)
-        for pid in panic_patients:
-            dpid = df[df["patient_id"] == pid].sort_values("timestamp")
-            if dpid["happiness"].isnull().all(): continue
-            first = dpid["happiness"].iloc[0]
-            last = dpid["happiness"].iloc[-1]
-            if last > first: improved += 1
+        # one sort, then each patient's earliest and latest reading (NaN never counts as improved)
+        history = df.loc[df["patient_id"].isin(panic_patients), ["patient_id", "timestamp", "happiness"]].sort_values("timestamp")
+        first = history.drop_duplicates("patient_id", keep="first").set_index("patient_id")["happiness"]
+        last = history.drop_duplicates("patient_id", keep="last").set_index("patient_id")["happiness"]
+        improved = int((last > first.reindex(last.index)).sum())
         if total > 0:
             pct = round((improved/total)*100)
             insights.append(f"{pct}% of students who are labeled with 'panic' in session titles show improved happiness.")
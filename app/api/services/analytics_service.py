@@ -1,76 +1,118 @@
 # app/api/services/analytics_service.py
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from datetime import datetime
-import pandas as pd
-import matplotlib.pyplot as plt
 import io
 import asyncio
-from app.core.db import get_db
+import binascii
+import threading
+from app.core.db import get_database
+from app.core.cache import ttl_cached
+
+# Documents per getMore when streaming per-student/per-therapist aggregation results
+STREAM_BATCH_SIZE = 500
+
+# Buckets reported in the admin session_distribution
+SESSION_TYPES = ("individual", "group", "emergency")
+
+# One figure reused for every chart; Agg rendering is not thread-safe, so the lock
+# serializes worker threads around it
+_chart_lock = threading.Lock()
+_chart_fig = None
+_chart_ax = None
+
+def _render_chart_png(dates: List[str], values: List[float], title: str, ylabel: str, color: Optional[str] = None) -> bytes:
+    """
+    Render a happiness line chart to PNG bytes. Blocking; run it via asyncio.to_thread.
+    Uses Figure + Agg canvas rather than pyplot, whose global state is not thread-safe.
+    """
+    global _chart_fig, _chart_ax
+    chart_buffer = io.BytesIO()
+    with _chart_lock:
+        if _chart_fig is None:
+            # matplotlib is only needed for PDF charts; import on first use to keep worker startup light
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            _chart_fig = Figure(figsize=(8, 4))
+            FigureCanvasAgg(_chart_fig)
+            _chart_ax = _chart_fig.subplots()
+        
+        ax = _chart_ax
+        ax.clear()
+        ax.plot(dates, values, marker='o', linewidth=2, markersize=6, color=color)
+        ax.set_title(title)
+        ax.set_xlabel("Date")
+        ax.set_ylabel(ylabel)
+        ax.tick_params(axis='x', labelrotation=45)
+        ax.grid(True, alpha=0.3)
+        _chart_fig.tight_layout()
+        
+        # 100 dpi is plenty for an on-screen/PDF preview and renders 9x fewer pixels than 300
+        _chart_fig.savefig(chart_buffer, format='png', dpi=100, bbox_inches='tight')
+    return chart_buffer.getvalue()
+
+def _render_chart_base64(*args) -> str:
+    """_render_chart_png, base64-encoded for JSON, so the encoding also stays off the event loop"""
+    return binascii.b2a_base64(_render_chart_png(*args), newline=False).decode("ascii")
 
 class AnalyticsService:
     """Service for analytics and reporting"""
     
-    def __init__(self):
-        self.db = None
-    
-    async def _get_db(self):
-        """Get database instance"""
-        if self.db is None:
-            async for db in get_db():
-                self.db = db
-                break
-        return self.db
-    
+    @ttl_cached("student", ttl=45, shared_ttl=300)
     async def get_student_happiness(self, student_id: str) -> Dict[str, Any]:
         """Get happiness trend for a student"""
         try:
-            db = await self._get_db()
+            db = await get_database()
             
-            # Query patient metrics for happiness data
+            # Daily averages, then one $facet pass for the series plus the overall
+            # average and first-half/second-half averages used for the trend
             pipeline = [
                 {"$match": {"patient_id": student_id}},
-                {"$sort": {"timestamp": 1}},
-                {"$project": {
-                    "date": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}},
-                    "happiness": "$happiness"
-                }},
                 {"$group": {
-                    "_id": "$date",
+                    "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}},
                     "avg_happiness": {"$avg": "$happiness"}
                 }},
-                {"$sort": {"_id": 1}}
+                {"$match": {"avg_happiness": {"$ne": None}}},
+                {"$sort": {"_id": 1}},
+                {"$project": {"_id": 0, "date": "$_id", "happiness": {"$round": ["$avg_happiness", 2]}}},
+                {"$facet": {
+                    "trend": [],
+                    "summary": [
+                        {"$group": {
+                            "_id": None,
+                            "values": {"$push": "$happiness"},
+                            "count": {"$sum": 1},
+                            "average": {"$avg": "$happiness"}
+                        }},
+                        {"$addFields": {"half": {"$max": [{"$floor": {"$divide": ["$count", 2]}}, 1]}}},
+                        {"$project": {
+                            "count": 1,
+                            "average": 1,
+                            "first_half": {"$slice": ["$values", 0, "$half"]},
+                            "second_half": {"$slice": ["$values", "$half", "$count"]}
+                        }},
+                        {"$project": {
+                            "count": 1,
+                            "average": 1,
+                            "first_avg": {"$avg": "$first_half"},
+                            "second_avg": {"$avg": "$second_half"}
+                        }}
+                    ]
+                }}
             ]
             
             cursor = db.patient_metrics.aggregate(pipeline)
-            happiness_data = await cursor.to_list(length=None)
-            
-            # Format the data
-            happiness_trend = []
-            total_happiness = 0
-            count = 0
-            
-            for item in happiness_data:
-                if item["avg_happiness"] is not None:
-                    happiness_trend.append({
-                        "date": item["_id"],
-                        "happiness": round(item["avg_happiness"], 2)
-                    })
-                    total_happiness += item["avg_happiness"]
-                    count += 1
+            result = (await cursor.to_list(length=1))[0]
+            happiness_trend = result["trend"]
+            summary = result["summary"][0] if result["summary"] else {"count": 0}
             
-            average_happiness = round(total_happiness / count, 2) if count > 0 else 0
+            average_happiness = round(summary["average"], 2) if summary["count"] > 0 else 0
             
             # Determine trend
             trend = "stable"
-            if len(happiness_trend) >= 2:
-                first_half = happiness_trend[:len(happiness_trend)//2]
-                second_half = happiness_trend[len(happiness_trend)//2:]
-                first_avg = sum(item["happiness"] for item in first_half) / len(first_half)
-                second_avg = sum(item["happiness"] for item in second_half) / len(second_half)
-                
-                if second_avg > first_avg + 5:
+            if summary["count"] >= 2:
+                if summary["second_avg"] > summary["first_avg"] + 5:
                     trend = "improving"
-                elif second_avg < first_avg - 5:
+                elif summary["second_avg"] < summary["first_avg"] - 5:
                     trend = "declining"
             
             return {
@@ -93,28 +135,14 @@ class AnalyticsService:
             
             # Generate chart
             if happiness_data.get("happiness_trend"):
-                plt.figure(figsize=(10, 6))
                 dates = [item["date"] for item in happiness_data["happiness_trend"]]
                 happiness_values = [item["happiness"] for item in happiness_data["happiness_trend"]]
                 
-                plt.plot(dates, happiness_values, marker='o', linewidth=2, markersize=6)
-                plt.title(f"Student Happiness Trend - ID: {student_id}")
-                plt.xlabel("Date")
-                plt.ylabel("Happiness Score")
-                plt.xticks(rotation=45)
-                plt.grid(True, alpha=0.3)
-                plt.tight_layout()
-                
-                # Save chart to bytes
-                chart_buffer = io.BytesIO()
-                plt.savefig(chart_buffer, format='png', dpi=300, bbox_inches='tight')
-                plt.close()
-                chart_buffer.seek(0)
-                chart_bytes = chart_buffer.getvalue()
-                
-                # Convert to base64 for PDF
-                import base64
-                chart_base64 = base64.b64encode(chart_bytes).decode()
+                # Render and base64-encode in a worker thread so the event loop keeps serving requests
+                chart_base64 = await asyncio.to_thread(
+                    _render_chart_base64, dates, happiness_values,
+                    f"Student Happiness Trend - ID: {student_id}", "Happiness Score"
+                )
                 
                 return {
                     "student_id": student_id,
@@ -136,30 +164,30 @@ class AnalyticsService:
     async def get_students_for_counselor(self, counselor_id: str) -> Dict[str, Any]:
         """Get list of students for a counselor"""
         try:
-            db = await self._get_db()
+            db = await get_database()
             
-            # Query sessions to find students assigned to this counselor
-            cursor = db.sessions.find(
-                {"therapist_id": counselor_id},
-                {"patient_id": 1, "date": 1, "_id": 0}
-            ).sort("date", -1)
-            
-            sessions = await cursor.to_list(length=None)
+            # One document per student with their latest session date, newest first
+            pipeline = [
+                {"$match": {"therapist_id": counselor_id}},
+                {"$group": {"_id": "$patient_id", "last_session": {"$max": "$date"}}},
+                {"$sort": {"last_session": -1, "_id": 1}}
+            ]
             
-            # Get unique students with their latest session date
-            student_sessions = {}
-            for session in sessions:
-                patient_id = session["patient_id"]
-                if patient_id not in student_sessions:
-                    student_sessions[patient_id] = session["date"]
+            # Every field the pipeline touches is in the index, so the plan is a covered IXSCAN
+            cursor = db.sessions.aggregate(
+                pipeline,
+                batchSize=STREAM_BATCH_SIZE,
+                hint=[("therapist_id", 1), ("patient_id", 1), ("date", -1)]
+            )
             
             # Format response
-            students = []
-            for patient_id, last_session in student_sessions.items():
-                students.append({
-                    "id": patient_id,
-                    "last_session": last_session.isoformat() if last_session else None
-                })
+            students = [
+                {
+                    "id": item["_id"],
+                    "last_session": item["last_session"].isoformat() if item["last_session"] else None
+                }
+                async for item in cursor
+            ]
             
             return {
                 "counselor_id": counselor_id,
@@ -172,59 +200,48 @@ class AnalyticsService:
                 "message": "Failed to get students for counselor"
             }
     
+    @ttl_cached("counselor", ttl=45, shared_ttl=300)
     async def get_counselor_analytics(self, counselor_id: str) -> Dict[str, Any]:
         """Get analytics for a counselor"""
         try:
-            db = await self._get_db()
+            db = await get_database()
             
-            # Get students for this counselor
-            students_data = await self.get_students_for_counselor(counselor_id)
-            student_ids = [student["id"] for student in students_data["students"]]
-            
-            # Get session analytics
+            # One round-trip: session stats plus the daily happiness of every student
+            # the counselor has seen, joined from patient_metrics on the patient ids
             pipeline = [
                 {"$match": {"therapist_id": counselor_id}},
                 {"$group": {
                     "_id": None,
                     "total_sessions": {"$sum": 1},
-                    "unique_patients": {"$addToSet": "$patient_id"}
+                    "patient_ids": {"$addToSet": "$patient_id"}
+                }},
+                {"$lookup": {
+                    "from": "patient_metrics",
+                    "localField": "patient_ids",
+                    "foreignField": "patient_id",
+                    "pipeline": [
+                        {"$group": {
+                            "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}},
+                            "avg_happiness": {"$avg": "$happiness"}
+                        }},
+                        {"$match": {"avg_happiness": {"$ne": None}}},
+                        {"$sort": {"_id": 1}},
+                        {"$project": {"_id": 0, "date": "$_id", "average_happiness": {"$round": ["$avg_happiness", 2]}}}
+                    ],
+                    "as": "happiness_trend"
                 }},
                 {"$project": {
+                    "_id": 0,
                     "total_sessions": 1,
-                    "unique_patients": {"$size": "$unique_patients"}
+                    "unique_patients": {"$size": "$patient_ids"},
+                    "happiness_trend": 1
                 }}
             ]
             
-            session_cursor = db.sessions.aggregate(pipeline)
-            session_data = await session_cursor.to_list(length=1)
-            
-            # Get happiness trend for all students
-            if student_ids:
-                happiness_pipeline = [
-                    {"$match": {"patient_id": {"$in": student_ids}}},
-                    {"$sort": {"timestamp": 1}},
-                    {"$project": {
-                        "date": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}},
-                        "happiness": "$happiness"
-                    }},
-                    {"$group": {
-                        "_id": "$date",
-                        "avg_happiness": {"$avg": "$happiness"}
-                    }},
-                    {"$sort": {"_id": 1}}
-                ]
-                
-                happiness_cursor = db.patient_metrics.aggregate(happiness_pipeline)
-                happiness_data = await happiness_cursor.to_list(length=None)
-                
-                happiness_trend = [
-                    {"date": item["_id"], "average_happiness": round(item["avg_happiness"], 2)}
-                    for item in happiness_data if item["avg_happiness"] is not None
-                ]
-            else:
-                happiness_trend = []
-            
-            session_stats = session_data[0] if session_data else {"total_sessions": 0, "unique_patients": 0}
+            cursor = db.sessions.aggregate(pipeline)
+            session_data = await cursor.to_list(length=1)
+            session_stats = session_data[0] if session_data else {"total_sessions": 0, "unique_patients": 0, "happiness_trend": []}
+            happiness_trend = session_stats["happiness_trend"]
             
             return {
                 "counselor_id": counselor_id,
@@ -248,26 +265,14 @@ class AnalyticsService:
             # Generate chart if we have happiness trend data
             chart_base64 = None
             if analytics.get("happiness_trend"):
-                plt.figure(figsize=(12, 8))
                 dates = [item["date"] for item in analytics["happiness_trend"]]
                 happiness_values = [item["average_happiness"] for item in analytics["happiness_trend"]]
                 
-                plt.plot(dates, happiness_values, marker='o', linewidth=2, markersize=6, color='blue')
-                plt.title(f"Counselor Analytics - ID: {counselor_id}")
-                plt.xlabel("Date")
-                plt.ylabel("Average Happiness Score")
-                plt.xticks(rotation=45)
-                plt.grid(True, alpha=0.3)
-                plt.tight_layout()
-                
-                # Save chart to bytes
-                chart_buffer = io.BytesIO()
-                plt.savefig(chart_buffer, format='png', dpi=300, bbox_inches='tight')
-                plt.close()
-                chart_buffer.seek(0)
-                
-                import base64
-                chart_base64 = base64.b64encode(chart_buffer.getvalue()).decode()
+                # Render and base64-encode in a worker thread so the event loop keeps serving requests
+                chart_base64 = await asyncio.to_thread(
+                    _render_chart_base64, dates, happiness_values,
+                    f"Counselor Analytics - ID: {counselor_id}", "Average Happiness Score", 'blue'
+                )
             
             return {
                 "counselor_id": counselor_id,
@@ -281,10 +286,11 @@ class AnalyticsService:
                 "message": "Failed to generate counselor PDF"
             }
     
+    @ttl_cached("admin", ttl=45)
     async def get_admin_overall_analytics(self, start_date: Optional[str] = None, end_date: Optional[str] = None) -> Dict[str, Any]:
         """Get organization-wide analytics for admin"""
         try:
-            db = await self._get_db()
+            db = await get_database()
             
             # Date filter
             date_filter = {}
@@ -293,64 +299,63 @@ class AnalyticsService:
             if end_date:
                 date_filter["$lte"] = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
             
-            # Get total counts
-            total_students = await db.patient_metrics.distinct("patient_id")
-            total_counselors = await db.sessions.distinct("therapist_id")
-            total_sessions = await db.sessions.count_documents({})
-            
-            # Get happiness trend across all students
+            # Happiness trend across all students; the overall average of the daily
+            # averages comes back from the same pass, so Python never walks the series
             happiness_pipeline = [
-                {"$sort": {"timestamp": 1}},
-                {"$project": {
-                    "date": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}},
-                    "happiness": "$happiness"
-                }},
                 {"$group": {
-                    "_id": "$date",
+                    "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}},
                     "avg_happiness": {"$avg": "$happiness"}
                 }},
-                {"$sort": {"_id": 1}}
+                {"$match": {"avg_happiness": {"$ne": None}}},
+                {"$facet": {
+                    "trend": [
+                        {"$sort": {"_id": 1}},
+                        {"$project": {"_id": 0, "date": "$_id", "average_happiness": {"$round": ["$avg_happiness", 2]}}}
+                    ],
+                    "summary": [{"$group": {"_id": None, "average": {"$avg": "$avg_happiness"}}}]
+                }}
             ]
             
             if date_filter:
                 happiness_pipeline.insert(0, {"$match": {"timestamp": date_filter}})
             
-            happiness_cursor = db.patient_metrics.aggregate(happiness_pipeline)
-            happiness_data = await happiness_cursor.to_list(length=None)
-            
-            happiness_trend = [
-                {"date": item["_id"], "average_happiness": round(item["avg_happiness"], 2)}
-                for item in happiness_data if item["avg_happiness"] is not None
-            ]
-            
-            # Calculate overall average happiness
-            avg_happiness = 0
-            if happiness_data:
-                total_happiness = sum(item["avg_happiness"] for item in happiness_data if item["avg_happiness"] is not None)
-                count = len([item for item in happiness_data if item["avg_happiness"] is not None])
-                avg_happiness = round(total_happiness / count, 2) if count > 0 else 0
-            
-            # Get session distribution
+            # Get session distribution; untyped sessions count as individual
+            # (grouping on the mapped value so they add to, not replace, that bucket)
             session_dist_pipeline = [
                 {"$group": {
-                    "_id": "$session_type",
+                    "_id": {"$ifNull": ["$session_type", "individual"]},
                     "count": {"$sum": 1}
                 }}
             ]
             
+            # The counts and both aggregations are independent: run them concurrently
+            happiness_cursor = db.patient_metrics.aggregate(happiness_pipeline)
             session_cursor = db.sessions.aggregate(session_dist_pipeline)
-            session_dist_data = await session_cursor.to_list(length=None)
-            
-            session_distribution = {
-                "individual": 0,
-                "group": 0,
-                "emergency": 0
+            (
+                total_students,
+                total_counselors,
+                total_sessions,
+                happiness_data,
+                session_dist_data,
+            ) = await asyncio.gather(
+                db.patient_metrics.distinct("patient_id"),
+                db.sessions.distinct("therapist_id"),
+                db.sessions.count_documents({}),
+                happiness_cursor.to_list(length=1),
+                session_cursor.to_list(length=None)
+            )
+            
+            happiness_trend = happiness_data[0]["trend"]
+            summary = happiness_data[0]["summary"]
+            average = summary[0]["average"] if summary else None
+            avg_happiness = round(average, 2) if average is not None else 0
+            
+            session_distribution = {"individual": 0, "group": 0, "emergency": 0} | {
+                item["_id"]: item["count"]
+                for item in session_dist_data
+                if item["_id"] in SESSION_TYPES
             }
             
-            for item in session_dist_data:
-                session_type = item["_id"] or "individual"
-                session_distribution[session_type] = item["count"]
-            
             return {
                 "total_students": len(total_students),
                 "total_counselors": len(total_counselors),
@@ -369,7 +374,7 @@ class AnalyticsService:
     async def get_all_therapists(self) -> Dict[str, Any]:
         """Get list of all therapists"""
         try:
-            db = await self._get_db()
+            db = await get_database()
             
             # Get therapist data from sessions
             pipeline = [
@@ -386,17 +391,18 @@ class AnalyticsService:
                 {"$sort": {"active_students": -1}}
             ]
             
-            cursor = db.sessions.aggregate(pipeline)
-            therapist_data = await cursor.to_list(length=None)
+            # Stream the result in batches instead of materializing every document first
+            cursor = db.sessions.aggregate(pipeline, batchSize=STREAM_BATCH_SIZE)
             
             # Format response
-            therapists = []
-            for item in therapist_data:
-                therapists.append({
+            therapists = [
+                {
                     "id": item["therapist_id"],
                     "session_count": item["session_count"],
                     "active_students": item["active_students"]
-                })
+                }
+                async for item in cursor
+            ]
             
             return {
                 "therapists": therapists,
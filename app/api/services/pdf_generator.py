@@ -2,167 +2,224 @@
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle
 from reportlab.lib.units import inch
+from reportlab.lib import colors
 import io
+import os
+import multiprocessing
 import asyncio
-import base64
-from typing import Dict, Any, List
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Minimal valid PDF returned when report generation fails, so clients still get a file
+PLACEHOLDER_PDF = b"%PDF-1.4\n1 0 obj<<>>endobj\ntrailer<<>>\n%%EOF"
+
+# Sample stylesheet built once; reports only read from it
+_STYLES = getSampleStyleSheet()
+TITLE_STYLE = _STYLES['Title']
+BODY_STYLE = _STYLES['Normal']
+
+# Shared look for trend tables: bold header row, light grid
+TREND_TABLE_STYLE = TableStyle([
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+    ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+    ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+])
+
+def _trend_table(header: List[str], rows: List[List[Any]]) -> Table:
+    """One Table flowable for trend rows instead of a Paragraph per row"""
+    table = Table([header] + rows, colWidths=[2 * inch, 1.5 * inch], hAlign='LEFT')
+    table.setStyle(TREND_TABLE_STYLE)
+    return table
+
+def _build_student_pdf(student_id: str, data: Dict[str, Any]) -> bytes:
+    """Render a student report; plain function so process-pool workers can run it"""
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    story = []
+
+    # Title
+    title_style = TITLE_STYLE
+    title = Paragraph(f"Student Report - ID: {student_id}", title_style)
+    story.append(title)
+    story.append(Spacer(1, 12))
+
+    # Student information
+    summary_style = BODY_STYLE
+
+    happiness_data = data.get('happiness_data', {})
+    avg_happiness = happiness_data.get('average_happiness', 0)
+    trend = happiness_data.get('trend', 'unknown')
+
+    info_text = f"""
+    <b>Student Information:</b><br/>
+    Student ID: {student_id}<br/>
+    Average Happiness: {avg_happiness}/100<br/>
+    Trend: {trend}<br/>
+    """
+    story.append(Paragraph(info_text, summary_style))
+    story.append(Spacer(1, 12))
+
+    # Happiness trend
+    happiness_trend = happiness_data.get('happiness_trend', [])
+    if happiness_trend:
+        trend_text = f"""
+        <b>Happiness Trend Data:</b><br/>
+        Total Records: {len(happiness_trend)}<br/>
+        Date Range: {happiness_trend[0]['date']} to {happiness_trend[-1]['date']}<br/>
+        """
+        story.append(Paragraph(trend_text, summary_style))
+
+        # Add trend data table
+        rows = [[item['date'], item['happiness']] for item in happiness_trend[:10]]  # Limit to first 10 entries
+        story.append(_trend_table(["Date", "Happiness"], rows))
+
+    # Build PDF
+    doc.build(story)
+    return buffer.getvalue()
+
+def _build_admin_pdf(data: Dict[str, Any]) -> bytes:
+    """Render the organization-wide report; blocking, so callers run it in a worker process"""
+    # Create PDF in memory
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    story = []
+    
+    # Title
+    title_style = TITLE_STYLE
+    title = Paragraph("Organization Analytics Report", title_style)
+    story.append(title)
+    story.append(Spacer(1, 12))
+    
+    # Summary section
+    summary_style = BODY_STYLE
+    
+    # Total statistics
+    stats_text = f"""
+    <b>Organization Overview:</b><br/>
+    Total Students: {data.get('total_students', 0)}<br/>
+    Total Counselors: {data.get('total_counselors', 0)}<br/>
+    Total Sessions: {data.get('total_sessions', 0)}<br/>
+    Average Happiness Score: {data.get('average_happiness_score', 0)}<br/>
+    """
+    story.append(Paragraph(stats_text, summary_style))
+    story.append(Spacer(1, 12))
+    
+    # Session distribution
+    session_dist = data.get('session_distribution', {})
+    session_text = f"""
+    <b>Session Distribution:</b><br/>
+    Individual Sessions: {session_dist.get('individual', 0)}<br/>
+    Group Sessions: {session_dist.get('group', 0)}<br/>
+    Emergency Sessions: {session_dist.get('emergency', 0)}<br/>
+    """
+    story.append(Paragraph(session_text, summary_style))
+    story.append(Spacer(1, 12))
+    
+    # Top issues
+    top_issues = data.get('top_issues', [])
+    issues_text = f"""
+    <b>Top Issues:</b><br/>
+    {', '.join(top_issues)}<br/>
+    """
+    story.append(Paragraph(issues_text, summary_style))
+    story.append(Spacer(1, 12))
+    
+    # Happiness trend summary
+    happiness_trend = data.get('happiness_trend', [])
+    if happiness_trend:
+        trend_text = f"""
+        <b>Happiness Trend Summary:</b><br/>
+        Total Data Points: {len(happiness_trend)}<br/>
+        Date Range: {happiness_trend[0]['date']} to {happiness_trend[-1]['date']}<br/>
+        """
+        story.append(Paragraph(trend_text, summary_style))
+    
+    # Build PDF
+    doc.build(story)
+    return buffer.getvalue()
+
+# Worker processes for report rendering: reportlab holds the GIL, so threads would not scale.
+# Each worker imports this module (and reportlab) once and then serves many reports.
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    if _pdf_pool is None:
+        # forkserver, not fork: this process already runs threads (log listener, Motor
+        # executor) and forking it could hand workers a lock held by one of them
+        _pdf_pool = ProcessPoolExecutor(
+            max_workers=os.cpu_count(),
+            mp_context=multiprocessing.get_context("forkserver")
+        )
+    return _pdf_pool
+
+def shutdown_pdf_pool() -> None:
+    """Stop the bulk-export workers; called on application shutdown"""
+    global _pdf_pool
+    if _pdf_pool is not None:
+        _pdf_pool.shutdown(cancel_futures=True)
+        _pdf_pool = None
 
 class PDFService:
     """Service for PDF generation"""
     
-    async def generate_admin_pdf(self, data: Dict[str, Any]) -> str:
+    async def generate_admin_pdf(self, data: Dict[str, Any]) -> bytes:
         """Generate organization-wide PDF report"""
         try:
-            # Create PDF in memory
-            buffer = io.BytesIO()
-            doc = SimpleDocTemplate(buffer, pagesize=letter)
-            styles = getSampleStyleSheet()
-            story = []
-            
-            # Title
-            title_style = styles['Title']
-            title = Paragraph("Organization Analytics Report", title_style)
-            story.append(title)
-            story.append(Spacer(1, 12))
-            
-            # Summary section
-            summary_style = styles['Normal']
-            
-            # Total statistics
-            stats_text = f"""
-            <b>Organization Overview:</b><br/>
-            Total Students: {data.get('total_students', 0)}<br/>
-            Total Counselors: {data.get('total_counselors', 0)}<br/>
-            Total Sessions: {data.get('total_sessions', 0)}<br/>
-            Average Happiness Score: {data.get('average_happiness_score', 0)}<br/>
-            """
-            story.append(Paragraph(stats_text, summary_style))
-            story.append(Spacer(1, 12))
-            
-            # Session distribution
-            session_dist = data.get('session_distribution', {})
-            session_text = f"""
-            <b>Session Distribution:</b><br/>
-            Individual Sessions: {session_dist.get('individual', 0)}<br/>
-            Group Sessions: {session_dist.get('group', 0)}<br/>
-            Emergency Sessions: {session_dist.get('emergency', 0)}<br/>
-            """
-            story.append(Paragraph(session_text, summary_style))
-            story.append(Spacer(1, 12))
-            
-            # Top issues
-            top_issues = data.get('top_issues', [])
-            issues_text = f"""
-            <b>Top Issues:</b><br/>
-            {', '.join(top_issues)}<br/>
-            """
-            story.append(Paragraph(issues_text, summary_style))
-            story.append(Spacer(1, 12))
+            # Render in a worker process so the event loop keeps serving requests meanwhile
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(_get_pdf_pool(), _build_admin_pdf, data)
             
-            # Happiness trend summary
-            happiness_trend = data.get('happiness_trend', [])
-            if happiness_trend:
-                trend_text = f"""
-                <b>Happiness Trend Summary:</b><br/>
-                Total Data Points: {len(happiness_trend)}<br/>
-                Date Range: {happiness_trend[0]['date']} to {happiness_trend[-1]['date']}<br/>
-                """
-                story.append(Paragraph(trend_text, summary_style))
-            
-            # Build PDF
-            doc.build(story)
-            buffer.seek(0)
-            
-            # Convert to base64
-            pdf_bytes = buffer.getvalue()
-            pdf_base64 = base64.b64encode(pdf_bytes).decode()
-            
-            return pdf_base64
-            
-        except Exception as e:
-            # Return error as base64 encoded text
-            error_text = f"Error generating PDF: {str(e)}"
-            error_bytes = error_text.encode()
-            return base64.b64encode(error_bytes).decode()
+        except Exception:
+            logger.exception("Error generating admin PDF")
+            return PLACEHOLDER_PDF
     
-    async def generate_student_pdf(self, student_id: str, data: Dict[str, Any]) -> str:
+    async def generate_student_pdf(self, student_id: str, data: Dict[str, Any]) -> bytes:
         """Generate student-specific PDF report"""
         try:
-            buffer = io.BytesIO()
-            doc = SimpleDocTemplate(buffer, pagesize=letter)
-            styles = getSampleStyleSheet()
-            story = []
-            
-            # Title
-            title_style = styles['Title']
-            title = Paragraph(f"Student Report - ID: {student_id}", title_style)
-            story.append(title)
-            story.append(Spacer(1, 12))
-            
-            # Student information
-            summary_style = styles['Normal']
-            
-            happiness_data = data.get('happiness_data', {})
-            avg_happiness = happiness_data.get('average_happiness', 0)
-            trend = happiness_data.get('trend', 'unknown')
-            
-            info_text = f"""
-            <b>Student Information:</b><br/>
-            Student ID: {student_id}<br/>
-            Average Happiness: {avg_happiness}/100<br/>
-            Trend: {trend}<br/>
-            """
-            story.append(Paragraph(info_text, summary_style))
-            story.append(Spacer(1, 12))
-            
-            # Happiness trend
-            happiness_trend = happiness_data.get('happiness_trend', [])
-            if happiness_trend:
-                trend_text = f"""
-                <b>Happiness Trend Data:</b><br/>
-                Total Records: {len(happiness_trend)}<br/>
-                Date Range: {happiness_trend[0]['date']} to {happiness_trend[-1]['date']}<br/>
-                """
-                story.append(Paragraph(trend_text, summary_style))
-                
-                # Add trend data table
-                for item in happiness_trend[:10]:  # Limit to first 10 entries
-                    trend_item = f"Date: {item['date']}, Happiness: {item['happiness']}<br/>"
-                    story.append(Paragraph(trend_item, summary_style))
-            
-            # Build PDF
-            doc.build(story)
-            buffer.seek(0)
-            
-            # Convert to base64
-            pdf_bytes = buffer.getvalue()
-            pdf_base64 = base64.b64encode(pdf_bytes).decode()
-            
-            return pdf_base64
-            
-        except Exception as e:
-            error_text = f"Error generating student PDF: {str(e)}"
-            error_bytes = error_text.encode()
-            return base64.b64encode(error_bytes).decode()
+            return _build_student_pdf(student_id, data)
+        except Exception:
+            logger.exception("Error generating student PDF")
+            return PLACEHOLDER_PDF
+    
+    async def generate_students_pdfs_bulk(self, reports: Dict[str, Dict[str, Any]]) -> Dict[str, bytes]:
+        """Generate many student PDFs in parallel worker processes (student_id -> PDF bytes)"""
+        loop = asyncio.get_running_loop()
+        pool = _get_pdf_pool()
+        student_ids = list(reports)
+        results = await asyncio.gather(
+            *(loop.run_in_executor(pool, _build_student_pdf, sid, reports[sid]) for sid in student_ids),
+            return_exceptions=True
+        )
+        pdfs = {}
+        for sid, result in zip(student_ids, results):
+            if isinstance(result, BaseException):
+                logger.error("Error generating student PDF for %s: %s", sid, result)
+                result = PLACEHOLDER_PDF
+            pdfs[sid] = result
+        return pdfs
     
-    async def generate_counselor_pdf(self, counselor_id: str, data: Dict[str, Any]) -> str:
+    async def generate_counselor_pdf(self, counselor_id: str, data: Dict[str, Any]) -> bytes:
         """Generate counselor-specific PDF report"""
         try:
             buffer = io.BytesIO()
             doc = SimpleDocTemplate(buffer, pagesize=letter)
-            styles = getSampleStyleSheet()
             story = []
             
             # Title
-            title_style = styles['Title']
+            title_style = TITLE_STYLE
             title = Paragraph(f"Counselor Report - ID: {counselor_id}", title_style)
             story.append(title)
             story.append(Spacer(1, 12))
             
             # Counselor information
-            summary_style = styles['Normal']
+            summary_style = BODY_STYLE
             
             analytics = data.get('analytics', {})
             total_sessions = analytics.get('total_sessions', 0)
@@ -179,6 +236,12 @@ class PDFService:
             story.append(Paragraph(info_text, summary_style))
             story.append(Spacer(1, 12))
             
+            # Trend chart rendered by the analytics service; reportlab reads the PNG bytes directly
+            chart_png = analytics.get('charts', {}).get('happiness_trend_png')
+            if chart_png:
+                story.append(Image(io.BytesIO(chart_png), width=6 * inch, height=3 * inch))
+                story.append(Spacer(1, 12))
+            
             # Happiness trend for counselor's students
             happiness_trend = analytics.get('happiness_trend', [])
             if happiness_trend:
@@ -189,21 +252,13 @@ class PDFService:
                 story.append(Paragraph(trend_text, summary_style))
                 
                 # Add trend summary
-                for item in happiness_trend[:5]:  # Limit to first 5 entries
-                    trend_item = f"Date: {item['date']}, Avg Happiness: {item['average_happiness']}<br/>"
-                    story.append(Paragraph(trend_item, summary_style))
+                rows = [[item['date'], item['average_happiness']] for item in happiness_trend[:5]]  # Limit to first 5 entries
+                story.append(_trend_table(["Date", "Avg Happiness"], rows))
             
             # Build PDF
             doc.build(story)
-            buffer.seek(0)
-            
-            # Convert to base64
-            pdf_bytes = buffer.getvalue()
-            pdf_base64 = base64.b64encode(pdf_bytes).decode()
-            
-            return pdf_base64
+            return buffer.getvalue()
             
-        except Exception as e:
-            error_text = f"Error generating counselor PDF: {str(e)}"
-            error_bytes = error_text.encode()
-            return base64.b64encode(error_bytes).decode()
+        except Exception:
+            logger.exception("Error generating counselor PDF")
+            return PLACEHOLDER_PDF
@@ -0,0 +1,254 @@
+# app/core/cache.py
+import functools
+import hashlib
+import logging
+import time
+from typing import Any, Dict, List, Optional, Set
+
+import orjson
+from cachetools import Cache, TTLCache
+
+from app.core.config import settings
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # optional: without redis the caches stay per-process
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+_caches: List[Cache] = []
+# Caches per key namespace ("student", "counselor", ...), so invalidate only visits the
+# caches that can hold a prefix; namespaces backed by Redis are tracked separately
+_namespaces: Dict[str, List[Cache]] = {}
+_shared_namespaces: Set[str] = set()
+
+cache_stats: Dict[str, int] = {
+    "cache_hits_total": 0,
+    "cache_misses_total": 0,
+    "shared_cache_hits_total": 0,
+}
+
+# Shared Redis tier behind the per-process caches, so workers reuse each other's results
+REDIS_KEY_PREFIX = "manmitra:cache:"
+# After a Redis error, skip the shared tier for this long instead of timing out on every call
+REDIS_RETRY_SECONDS = 30
+
+_redis = None
+_redis_down_until = 0.0
+# Bumped by invalidate/flush; a fill that started under an older generation may have
+# read stale data (from MongoDB or Redis) and is not stored
+_generation = 0
+
+
+def _shared_client():
+    """Redis client for the shared tier, or None if redis is missing or recently failed."""
+    global _redis
+    if aioredis is None or time.monotonic() < _redis_down_until:
+        return None
+    if _redis is None:
+        _redis = aioredis.Redis.from_url(
+            settings.REDIS_URL, socket_connect_timeout=0.25, socket_timeout=0.25
+        )
+    return _redis
+
+
+def _shared_failed(error: Exception) -> None:
+    global _redis_down_until
+    _redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+    logger.warning("Redis cache unavailable, using in-process caches for %ds: %s", REDIS_RETRY_SECONDS, error)
+
+
+async def _shared_get(key: str) -> Optional[Any]:
+    client = _shared_client()
+    if client is None:
+        return None
+    try:
+        raw = await client.get(REDIS_KEY_PREFIX + key)
+    except Exception as e:
+        _shared_failed(e)
+        return None
+    return orjson.loads(raw) if raw is not None else None
+
+
+async def _shared_set(key: str, value: Any, ttl: int) -> None:
+    client = _shared_client()
+    if client is None:
+        return
+    try:
+        await client.set(REDIS_KEY_PREFIX + key, orjson.dumps(value), ex=ttl)
+    except Exception as e:
+        _shared_failed(e)
+
+
+async def _shared_delete(prefix: str) -> None:
+    client = _shared_client()
+    if client is None:
+        return
+    try:
+        keys = [key async for key in client.scan_iter(match=f"{REDIS_KEY_PREFIX}{prefix}*")]
+        if keys:
+            await client.delete(*keys)
+    except Exception as e:
+        _shared_failed(e)
+
+
+def _owner_prefix(key: str) -> str:
+    """'<prefix>:<owner>:' part of a key built by _make_key"""
+    return key.rsplit(":", 1)[0] + ":"
+
+
+class _OwnerIndexedCache(TTLCache):
+    """
+    TTLCache that also indexes its keys by owner prefix, so invalidating one student
+    touches only that student's entries instead of scanning every key.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.owners: Dict[str, Set[str]] = {}
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.owners.setdefault(_owner_prefix(key), set()).add(key)
+
+    def __delitem__(self, key):
+        try:
+            super().__delitem__(key)
+        finally:
+            self._unindex(key)
+
+    def expire(self, time=None):
+        # TTLCache.expire drops entries without going through __delitem__
+        expired = super().expire(time)
+        for key, _ in expired:
+            self._unindex(key)
+        return expired
+
+    def _unindex(self, key: str) -> None:
+        owner = _owner_prefix(key)
+        keys = self.owners.get(owner)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.owners[owner]
+
+    def pop_prefix(self, prefix: str) -> int:
+        """Drop every entry whose key starts with `prefix`; returns the number dropped"""
+        if prefix in self.owners:
+            owners = [prefix]
+        else:
+            owners = [owner for owner in self.owners if owner.startswith(prefix)]
+        removed = 0
+        for owner in owners:
+            for key in list(self.owners.get(owner, ())):
+                if self.pop(key, None) is not None:
+                    removed += 1
+            # expired keys that pop() skipped are unindexed by the next expire()
+            self.owners.pop(owner, None)
+        return removed
+
+
+def _make_key(prefix: str, args: tuple, kwargs: Dict[str, Any]) -> str:
+    """Build '<prefix>:<first arg>:<digest>' so entries can be invalidated per owner."""
+    owner = args[0] if args else None
+    digest = hashlib.blake2b(
+        repr((args, sorted(kwargs.items()))).encode(), digest_size=16
+    ).hexdigest()
+    return f"{prefix}:{owner}:{digest}"
+
+
+def ttl_cached(prefix: str, ttl: int = 45, maxsize: int = 1024, shared_ttl: Optional[int] = None):
+    """
+    Cache the results of an async service method for `ttl` seconds.
+    With `shared_ttl`, results are also kept in Redis for that long and reused across workers.
+    Error payloads (dicts with an "error" key) are never cached.
+    """
+    def decorator(func):
+        cache = _OwnerIndexedCache(maxsize=maxsize, ttl=ttl)
+        _caches.append(cache)
+        _namespaces.setdefault(prefix, []).append(cache)
+        if shared_ttl:
+            _shared_namespaces.add(prefix)
+
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            key = _make_key(prefix, args, kwargs)
+            try:
+                result = cache[key]
+                cache_stats["cache_hits_total"] += 1
+                return result
+            except KeyError:
+                pass
+
+            generation = _generation
+            if shared_ttl:
+                result = await _shared_get(key)
+                if result is not None:
+                    cache_stats["shared_cache_hits_total"] += 1
+                    if generation == _generation:
+                        cache[key] = result
+                    return result
+
+            cache_stats["cache_misses_total"] += 1
+            result = await func(self, *args, **kwargs)
+            if generation == _generation and not (isinstance(result, dict) and "error" in result):
+                cache[key] = result
+                if shared_ttl:
+                    await _shared_set(key, result, shared_ttl)
+            return result
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
+
+
+def register(cache: Cache, prefix: Optional[str] = None) -> Cache:
+    """
+    Track a cache created outside `ttl_cached` so `flush` covers it. With `prefix`, the
+    cache is derived from that namespace's data and is cleared whenever it is invalidated;
+    without one it is only cleared by `flush`.
+    """
+    _caches.append(cache)
+    if prefix is not None:
+        _namespaces.setdefault(prefix, []).append(cache)
+    return cache
+
+
+async def invalidate(prefix: str) -> int:
+    """
+    Drop all cached entries whose key starts with `prefix` ("<namespace>:" or
+    "<namespace>:<owner>:"), in Redis as well, plus caches registered for the namespace.
+    Fills already in flight are discarded, so a racing read cannot put stale data back.
+    """
+    global _generation
+    namespace = prefix.split(":", 1)[0]
+    _generation += 1
+    if namespace in _shared_namespaces:
+        await _shared_delete(prefix)
+    _generation += 1
+    removed = 0
+    for cache in _namespaces.get(namespace, ()):
+        if isinstance(cache, _OwnerIndexedCache):
+            removed += cache.pop_prefix(prefix)
+        else:
+            removed += len(cache)
+            cache.clear()
+    if removed:
+        logger.debug("Invalidated %d cached entries for %s", removed, prefix)
+    return removed
+
+
+async def flush() -> int:
+    """Clear every registered cache, in Redis as well, and return the number of dropped local entries."""
+    global _generation
+    _generation += 1
+    await _shared_delete("")
+    _generation += 1
+    removed = 0
+    for cache in _caches:
+        removed += len(cache)
+        cache.clear()
+    logger.info("Flushed %d cached entries", removed)
+    return removed
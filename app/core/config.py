@@ -1,5 +1,6 @@
 import os
-from typing import List, Any
+from functools import cached_property
+from typing import Any, FrozenSet, Tuple
 from pydantic_settings import BaseSettings
 from pydantic import Field, field_validator
 
@@ -40,16 +41,21 @@ class Settings(BaseSettings):
         env="CRISIS_KEYWORDS"
     )
     
-    @property
-    def crisis_keywords_list(self) -> List[str]:
-        """Get crisis keywords as a list"""
+    @cached_property
+    def crisis_keywords_list(self) -> Tuple[str, ...]:
+        """Crisis keywords parsed from CRISIS_KEYWORDS once per Settings instance"""
         if not self.CRISIS_KEYWORDS or self.CRISIS_KEYWORDS.strip() == "":
-            return [
+            return (
                 "suicide", "kill myself", "end it", "don't want to live",
                 "self harm", "hurt myself", "die", "death", "dead",
                 "not worth living", "better off dead", "end my life"
-            ]
-        return [keyword.strip() for keyword in self.CRISIS_KEYWORDS.split(',')]
+            )
+        return tuple(keyword.strip() for keyword in self.CRISIS_KEYWORDS.split(',') if keyword.strip())
+    
+    @cached_property
+    def crisis_keywords_set(self) -> FrozenSet[str]:
+        """Lowercased crisis keywords for O(1) membership checks"""
+        return frozenset(keyword.lower() for keyword in self.crisis_keywords_list)
     
     # Safety Configuration
     SAFETY_TEMPERATURE: float = Field(default=0.2, env="SAFETY_TEMPERATURE")
@@ -65,6 +71,10 @@ class Settings(BaseSettings):
     REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379")
     MONGO_URI: str = Field(default="mongodb://localhost:27017", env="MONGO_URI")
     MONGO_DB_NAME: str = os.getenv("MONGO_DB_NAME", "chatbot_db")
+    MONGO_MAX_POOL_SIZE: int = Field(default=50, env="MONGO_MAX_POOL_SIZE")
+    MONGO_MIN_POOL_SIZE: int = Field(default=10, env="MONGO_MIN_POOL_SIZE")
+    MONGO_MAX_IDLE_TIME_MS: int = Field(default=60000, env="MONGO_MAX_IDLE_TIME_MS")
+    MONGO_SERVER_SELECTION_TIMEOUT_MS: int = Field(default=2000, env="MONGO_SERVER_SELECTION_TIMEOUT_MS")
     
     # JWT Secret
     JWT_SECRET: str = Field(default="SuperSecretKey123", env="JWT_SECRET")
@@ -72,17 +82,6 @@ class Settings(BaseSettings):
     # Message validation
     MAX_MESSAGE_LENGTH: int = Field(default=2000, env="MAX_MESSAGE_LENGTH")
     
-    # Crisis detection keywords
-    CRISIS_KEYWORDS: str = Field(
-        default="suicide,kill myself,end it,don't want to live,self harm,hurt myself,die,death,dead,not worth living,better off dead,end my life",
-        env="CRISIS_KEYWORDS"
-    )
-    
-    @property
-    def crisis_keywords_list(self) -> list:
-        """Convert crisis keywords string to list"""
-        return [keyword.strip() for keyword in self.CRISIS_KEYWORDS.split(",")]
-    
     class Config:
         env_file = ".env"
         case_sensitive = True
@@ -1,26 +1,105 @@
 # app/core/db.py
+import asyncio
 import logging
-from typing import AsyncGenerator
-from motor.motor_asyncio import AsyncIOMotorClient
 from app.core.config import settings
+# Motor's thread pool size (MOTOR_MAX_WORKERS) is set by app.main before this import
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import OperationFailure
 
 logger = logging.getLogger(__name__)
 
+# Append-only per-patient series, bucketed by patient (low-cardinality metaField)
+TIMESERIES_COLLECTIONS = {
+    "patient_metrics": {"timeField": "timestamp", "metaField": "patient_id", "granularity": "hours"},
+    "session_summaries": {"timeField": "date", "metaField": "patient_id", "granularity": "hours"},
+}
+
+# (collection, keys, options) created on connect; create_index is a no-op when present
+INDEXES = [
+    ("patient_metrics", [("patient_id", 1), ("timestamp", 1)], {}),
+    # covers distinct("patient_id", {"therapist_id": ...}) as a DISTINCT_SCAN, and the
+    # per-student last-session $group without fetching the (wide) session documents
+    ("sessions", [("therapist_id", 1), ("patient_id", 1), ("date", -1)], {"name": "therapist_patient_date"}),
+    # counselor session lists: $match on therapist_id, newest first, without an in-memory sort
+    ("sessions", [("therapist_id", 1), ("date", -1)], {}),
+    ("session_summaries", [("patient_id", 1), ("date", 1)], {}),
+    ("articles", [("published_at", -1)], {}),
+]
+
 class MongoDB:
     client: AsyncIOMotorClient | None = None
     database = None
+    # Concurrent first requests must not each build their own client and pool
+    _connect_lock = asyncio.Lock()
 
     async def connect(self):
         """Connect to MongoDB and ping to check connection."""
-        try:
-            self.client = AsyncIOMotorClient(settings.MONGO_URI)
-            self.database = self.client[settings.MONGO_DB_NAME]
-            # Ping to check if connection is successful
-            await self.client.admin.command('ping')
-            logger.info("Connected to MongoDB successfully")
-        except Exception as e:
-            logger.error(f"Error connecting to MongoDB: {e}")
-            raise
+        async with self._connect_lock:
+            if self.database is not None:
+                return
+            try:
+                # One client (and one connection pool) shared by the whole application
+                self.client = AsyncIOMotorClient(
+                    settings.MONGO_URI,
+                    maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+                    minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+                    maxIdleTimeMS=settings.MONGO_MAX_IDLE_TIME_MS,
+                    serverSelectionTimeoutMS=settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                )
+                self.database = self.client[settings.MONGO_DB_NAME]
+                # Ping to check if connection is successful
+                await self.client.admin.command('ping')
+                logger.info("Connected to MongoDB successfully")
+                await self.ensure_collections()
+                await self.ensure_indexes()
+                await self.warm_pool()
+            except Exception as e:
+                logger.error(f"Error connecting to MongoDB: {e}")
+                # Leave the handle unset so the next get_database() retries the full setup
+                self.database = None
+                raise
+
+    async def ensure_collections(self):
+        """
+        Create the time-series collections on first start.
+        Must run before ensure_indexes, which would otherwise create them as regular collections.
+        Only new databases get time-series collections: an existing regular collection is left
+        as is (MongoDB cannot convert in place) and keeps working through the same indexes.
+        """
+        cursor = await self.database.list_collections()
+        existing = {info["name"]: info.get("type") async for info in cursor}
+        for name, options in TIMESERIES_COLLECTIONS.items():
+            if name not in existing:
+                await self.database.create_collection(name, timeseries=options)
+                logger.info(f"Created time-series collection {name}")
+            elif existing[name] != "timeseries":
+                logger.warning(
+                    f"Collection {name} is not a time-series collection and will stay a regular one; "
+                    f"to migrate, create a time-series collection with {options} and copy the "
+                    f"documents into it (the {options['timeField']} field must be a date), then rename it"
+                )
+
+    async def ensure_indexes(self):
+        """Create the indexes the query paths rely on."""
+        for collection, keys, options in INDEXES:
+            try:
+                await self.database[collection].create_index(keys, **options)
+            except OperationFailure as e:
+                # Same keys already indexed under another name/options; the existing index still serves queries
+                if e.code not in (85, 86):  # IndexOptionsConflict, IndexKeySpecsConflict
+                    raise
+                logger.warning(f"Index on {collection} {keys} already exists with different options: {e}")
+        logger.info("MongoDB indexes ensured")
+
+    async def warm_pool(self):
+        """
+        Open minPoolSize connections now with concurrent pings, so early requests
+        don't pay TCP/TLS handshakes; each in-flight ping checks out its own connection.
+        """
+        await asyncio.gather(
+            *(self.client.admin.command('ping') for _ in range(settings.MONGO_MIN_POOL_SIZE))
+        )
+        logger.info(f"MongoDB connection pool warmed with {settings.MONGO_MIN_POOL_SIZE} connections")
 
     async def close(self):
         """Close MongoDB connection."""
@@ -39,12 +118,17 @@ class MongoDB:
 mongodb = MongoDB()
 
 
+async def get_database():
+    """Return the shared database handle, connecting on first use."""
+    if mongodb.database is None:
+        await mongodb.connect()
+    return mongodb.database
+
+
 # Backward compatibility: get_db function for FastAPI dependency injection
-async def get_db() -> AsyncGenerator:
+async def get_db():
     """
-    Yield the MongoDB database instance.
-    Ensures database is connected before yielding.
+    Return the MongoDB database instance, connecting first if needed.
+    A plain return (no yield): nothing to tear down, so FastAPI skips the exit-stack bookkeeping.
     """
-    if mongodb.database is None:
-        await mongodb.connect()
-    yield mongodb.database
+    return await get_database()
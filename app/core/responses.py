@@ -0,0 +1,16 @@
+# app/core/responses.py
+from typing import Any
+
+import orjson
+from fastapi.responses import ORJSONResponse
+
+
+class DefaultJSONResponse(ORJSONResponse):
+    """orjson-backed JSON response that falls back to str() for values like ObjectId."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content,
+            default=str,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+        )
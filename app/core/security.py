@@ -1,43 +1,88 @@
 import os
+import time
+import hashlib
+import threading
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
-from jose import jwt
+import jwt
 from app.core.config import settings
-from app.core.db import get_db  # assuming you have a db.py in core
+from app.core.db import get_database
+from app.core import cache
 from bson import ObjectId
-from typing import Dict, Any
+from cachetools import TLRUCache
+from typing import Dict, Any, Optional
+
+# Optional crisis-scan backends, fastest first; without either each keyword is searched for in turn
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 
 SECRET_KEY = os.getenv("JWT_SECRET", settings.JWT_SECRET)
 ALGORITHM = "HS256"
+# Decode arguments built once instead of per request
+_ALGORITHMS = [ALGORITHM]
+_DECODE_OPTIONS = {"require": ["sub"]}
+
+# Verified users keyed by token hash, so repeat requests skip jwt.decode and the users lookup.
+# Entries live for USER_CACHE_SECONDS at most and never past the token's own expiry.
+USER_CACHE_SECONDS = 30
+
+
+def _user_cache_ttu(key, value, now):
+    _, token_exp = value
+    return now + min(token_exp - time.time(), USER_CACHE_SECONDS)
+
+
+_user_cache = cache.register(TLRUCache(maxsize=10000, ttu=_user_cache_ttu))
+
+
+class CurrentUser:
+    """Authenticated user returned by get_current_user; slots keep the per-request object small"""
+    __slots__ = ("id", "email", "role")
+
+    def __init__(self, id: str, email: Optional[str], role: str):
+        self.id = id
+        self.email = email
+        self.role = role
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> CurrentUser:
     """
     Decode JWT, fetch user from DB, and return minimal user object.
     """
+    cache_key = "user:" + hashlib.sha256(token.encode()).hexdigest()
+    cached = _user_cache.get(cache_key)
+    if cached is not None:
+        return cached[0]
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Invalid token payload")
-
-        async for db in get_db():
-            user = await db.users.find_one({"_id": ObjectId(user_id)})
-            break
-        if not user:
-            raise HTTPException(status_code=401, detail="User not found")
-
-        # Return lightweight user object
-        return {
-            "id": str(user["_id"]),
-            "email": user.get("email"),
-            "role": user.get("role", "patient")
-        }
-    except Exception as e:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=_ALGORITHMS, options=_DECODE_OPTIONS)
+    except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
+    # Reject malformed subjects before spending a database round-trip on them
+    user_id = payload.get("sub")
+    if not isinstance(user_id, str) or not ObjectId.is_valid(user_id):
+        raise HTTPException(status_code=401, detail="Invalid token payload")
+
+    db = await get_database()
+    user = await db.users.find_one({"_id": ObjectId(user_id)}, projection={"email": 1, "role": 1})
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+
+    # Return lightweight user object
+    current_user = CurrentUser(str(user["_id"]), user.get("email"), user.get("role", "patient"))
+    _user_cache[cache_key] = (current_user, payload.get("exp", time.time() + USER_CACHE_SECONDS))
+    return current_user
+
 
 def require_roles(*roles):
     """
@@ -45,38 +90,125 @@ def require_roles(*roles):
     Example:
         @router.get("/admin", dependencies=[Depends(require_roles("admin"))])
     """
-    def role_checker(current_user=Depends(get_current_user)):
-        if current_user["role"] not in roles:
+    allowed = frozenset(roles)
+
+    # async so FastAPI runs it inline rather than dispatching it to the threadpool
+    async def role_checker(current_user=Depends(get_current_user)):
+        if current_user.role not in allowed:
             raise HTTPException(status_code=403, detail="Access forbidden")
         return current_user
 
     return role_checker
 
 
+# Severity tiers for crisis matches; plain crisis keywords rank as "low"
+HIGH_SEVERITY_KEYWORDS = frozenset(["suicide", "kill myself", "end it", "don't want to live", "self harm", "hurt myself"])
+MEDIUM_SEVERITY_KEYWORDS = frozenset(["die", "death", "dead", "not worth living", "better off dead", "end my life"])
+SEVERITY_LEVELS = ("low", "medium", "high")
+
+# Whitespace allowance over MAX_MESSAGE_LENGTH before validate_message rejects without stripping
+MESSAGE_LENGTH_SLACK = 64
+
+
+def _collect_match(match_id, start, end, flags, match_ids):
+    """Hyperscan match callback: record the keyword id and keep scanning"""
+    match_ids.add(match_id)
+
+
 class SafetyService:
     """Service for message validation and crisis detection"""
     
     def __init__(self):
-        self.crisis_keywords = settings.crisis_keywords_list
+        self.crisis_keywords = [keyword for keyword in settings.crisis_keywords_list if keyword]
+        self._crisis_keywords_lower = tuple(keyword.lower() for keyword in self.crisis_keywords)
+        
+        # Lowercased keyword -> (severity rank, is crisis keyword), covering the crisis
+        # keywords and both severity tiers so one scan yields matches and severity
+        self._keyword_entries = {}
+        tiers = ((0, self._crisis_keywords_lower), (1, MEDIUM_SEVERITY_KEYWORDS), (2, HIGH_SEVERITY_KEYWORDS))
+        for rank, keywords in tiers:
+            for keyword_lower in keywords:
+                prev_rank, is_crisis_keyword = self._keyword_entries.get(keyword_lower, (0, False))
+                self._keyword_entries[keyword_lower] = (max(rank, prev_rank), is_crisis_keyword or rank == 0)
+        
+        self._hs_keywords = tuple(self._keyword_entries)
+        self._hs_database = self._build_hyperscan_database() if hyperscan is not None else None
+        self._hs_local = threading.local()
+        self._automaton = (
+            self._build_automaton() if self._hs_database is None and ahocorasick is not None else None
+        )
+    
+    def _build_hyperscan_database(self):
+        """Compile every keyword into one Hyperscan literal database; match ids index _hs_keywords."""
+        database = hyperscan.Database()
+        database.compile(
+            expressions=[keyword_lower.encode() for keyword_lower in self._hs_keywords],
+            ids=list(range(len(self._hs_keywords))),
+            flags=0,
+            literal=True
+        )
+        return database
+    
+    def _hs_scratch(self):
+        # Scratch space cannot be shared by concurrent scans (detect_crisis runs in worker threads)
+        scratch = getattr(self._hs_local, "scratch", None)
+        if scratch is None:
+            scratch = self._hs_local.scratch = hyperscan.Scratch(self._hs_database)
+        return scratch
+    
+    def _build_automaton(self):
+        """One Aho-Corasick automaton over every keyword."""
+        automaton = ahocorasick.Automaton()
+        for keyword_lower in self._keyword_entries:
+            automaton.add_word(keyword_lower, keyword_lower)
+        automaton.make_automaton()
+        return automaton
+    
+    def _match_keywords(self, message_lower: str) -> set:
+        """Lowercased keywords (crisis and severity tiers) occurring in the message"""
+        if self._hs_database is not None:
+            match_ids = set()
+            self._hs_database.scan(
+                message_lower.encode(),
+                match_event_handler=_collect_match,
+                context=match_ids,
+                scratch=self._hs_scratch()
+            )
+            return {self._hs_keywords[match_id] for match_id in match_ids}
+        if self._automaton is not None:
+            return {keyword_lower for _, keyword_lower in self._automaton.iter(message_lower)}
+        # Without a native backend, one substring search per keyword (C fastsearch) beats a
+        # combined regex, which retries every alternative at each position of the message
+        return {keyword_lower for keyword_lower in self._keyword_entries if keyword_lower in message_lower}
     
     def validate_message(self, message: str) -> Dict[str, Any]:
         """Validate message content"""
-        if not message or len(message.strip()) == 0:
+        max_length = settings.MAX_MESSAGE_LENGTH
+        
+        # Reject far-oversized input before stripping, which would copy all of it;
+        # the slack keeps messages that only exceed the limit by surrounding whitespace valid
+        if message and len(message) > max_length + MESSAGE_LENGTH_SLACK:
             return {
                 "is_valid": False,
-                "reason": "Message cannot be empty",
-                "sanitized_text": ""
+                "reason": f"Message too long (max {max_length} characters)",
+                "sanitized_text": message[:max_length + MESSAGE_LENGTH_SLACK].strip()[:max_length]
             }
         
         # Basic sanitization
-        sanitized = message.strip()
+        sanitized = message.strip() if message else ""
+        if not sanitized:
+            return {
+                "is_valid": False,
+                "reason": "Message cannot be empty",
+                "sanitized_text": ""
+            }
         
         # Check message length
-        if len(sanitized) > settings.MAX_MESSAGE_LENGTH:
+        if len(sanitized) > max_length:
             return {
                 "is_valid": False,
-                "reason": f"Message too long (max {settings.MAX_MESSAGE_LENGTH} characters)",
-                "sanitized_text": sanitized[:settings.MAX_MESSAGE_LENGTH]
+                "reason": f"Message too long (max {max_length} characters)",
+                "sanitized_text": sanitized[:max_length]
             }
         
         return {
@@ -85,14 +217,35 @@ class SafetyService:
             "sanitized_text": sanitized
         }
     
+    def analyze(self, message: str) -> Dict[str, Any]:
+        """
+        Validate a chat message and, if valid, check its sanitized text for crisis indicators.
+        Returns {"validation": ..., "crisis": ...}; "crisis" is None for invalid messages.
+        """
+        validation = self.validate_message(message)
+        if not validation["is_valid"]:
+            return {"validation": validation, "crisis": None}
+        return {"validation": validation, "crisis": self.detect_crisis(validation["sanitized_text"])}
+    
     def detect_crisis(self, message: str) -> Dict[str, Any]:
         """Detect crisis indicators in message"""
-        message_lower = message.lower()
         matched_patterns = []
+        found = set()
+        max_rank = 0
+        
+        for keyword_lower in self._match_keywords(message.lower()):
+            rank, is_crisis_keyword = self._keyword_entries[keyword_lower]
+            if is_crisis_keyword:
+                found.add(keyword_lower)
+            if rank > max_rank:
+                max_rank = rank
         
-        for keyword in self.crisis_keywords:
-            if keyword.lower() in message_lower:
-                matched_patterns.append(keyword)
+        if found:
+            matched_patterns = [
+                keyword
+                for keyword, keyword_lower in zip(self.crisis_keywords, self._crisis_keywords_lower)
+                if keyword_lower in found
+            ]
         
         if not matched_patterns:
             return {
@@ -101,19 +254,10 @@ class SafetyService:
                 "matched_patterns": []
             }
         
-        # Determine severity based on matched patterns
-        high_severity_keywords = ["suicide", "kill myself", "end it", "don't want to live", "self harm", "hurt myself"]
-        medium_severity_keywords = ["die", "death", "dead", "not worth living", "better off dead", "end my life"]
-        
-        severity = "low"
-        if any(keyword in message_lower for keyword in high_severity_keywords):
-            severity = "high"
-        elif any(keyword in message_lower for keyword in medium_severity_keywords):
-            severity = "medium"
-        
+        # Severity is the highest tier among the matched keywords
         return {
             "is_crisis": True,
-            "severity": severity,
+            "severity": SEVERITY_LEVELS[max_rank],
             "matched_patterns": matched_patterns
         }
 
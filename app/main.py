@@ -1,16 +1,38 @@
+import logging
+import os
+import sys
+from app.core.config import settings
+
+# Motor sizes its PyMongo thread pool from MOTOR_MAX_WORKERS once, when it is first imported
+# (default 5 threads per core). This must run before the imports below, which pull in motor
+# via app.core.db; keep at least one thread per pooled connection so concurrent queries are
+# never serialized behind a small pool on low-core containers.
+if "motor" in sys.modules:
+    logging.getLogger(__name__).warning("motor was imported before app.main; MOTOR_MAX_WORKERS is not applied")
+os.environ.setdefault(
+    "MOTOR_MAX_WORKERS", str(max(settings.MONGO_MAX_POOL_SIZE, 5 * (os.cpu_count() or 1)))
+)
+
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 import uvicorn
-import os
 from dotenv import load_dotenv
 from app.api.router import api_router
+from app.api.endpoints.chat import bestie_reply, ChatMessage, MIN_CHAT_MESSAGE_LENGTH, MAX_CHAT_MESSAGE_LENGTH
 
-# Load environment variables before importing settings
+# Load .env into os.environ for the lookups below (settings reads .env itself)
 load_dotenv()
-from app.core.config import settings
+from app.core.db import mongodb
+from app.api.services.pdf_generator import shutdown_pdf_pool
+from app.core.security import safety_service
+from app.core.logging_config import setup_logging
+from app.core.responses import DefaultJSONResponse
+
+setup_logging(settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
 
 # Create FastAPI app
 app = FastAPI(
@@ -18,23 +40,46 @@ app = FastAPI(
     description="This service handles all AI-powered features for ManMitra, including the Bestie Chatbot and content moderation.",
     version="1.0.0",
     docs_url="/docs" if settings.ENVIRONMENT == "development" else None,
-    redoc_url="/redoc" if settings.ENVIRONMENT == "development" else None
+    redoc_url="/redoc" if settings.ENVIRONMENT == "development" else None,
+    default_response_class=DefaultJSONResponse
 )
 
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
+# Allowed origins, resolved once at import; an unset FRONTEND_URL adds no entry
+CORS_ORIGINS = frozenset(
+    origin
+    for origin in (
         "http://localhost:3000",  # User frontend
         "http://localhost:3001",  # Admin frontend
         "http://localhost:3002",  # Portal
-        "http://localhost:3003", 
-         os.environ.get("FRONTEND_URL", ""), # Volunteer frontend
-    ],
+        "http://localhost:3003",
+        os.environ.get("FRONTEND_URL"),  # Volunteer frontend
+    )
+    if origin
+)
+
+# CORS middleware
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
+@app.on_event("startup")
+async def connect_db():
+    # Connect before the first request so request paths find the shared handle ready;
+    # if MongoDB is down, get_database() retries on first use instead
+    try:
+        await mongodb.connect()
+    except Exception as e:
+        logger.warning(f"MongoDB not reachable at startup, will retry on first use: {e}")
+
+
+@app.on_event("shutdown")
+async def close_resources():
+    await mongodb.close()
+    shutdown_pdf_pool()
+
 # Include API routes
 app.include_router(api_router, prefix="/api")
 # Health check endpoint
@@ -50,7 +95,9 @@ async def root():
 
 # Lightweight adapter for the frontend Chat with Bestie
 class ChatRequest(BaseModel):
-    message: str
+    # Same bounds as ChatMessage, so /chat accepts exactly what /chat/ask does; oversized
+    # bodies are rejected while parsing, before any safety scan runs
+    message: str = Field(..., min_length=MIN_CHAT_MESSAGE_LENGTH, max_length=MAX_CHAT_MESSAGE_LENGTH)
     user_id: Optional[str] = None
 
 
@@ -58,7 +105,9 @@ class ChatReply(BaseModel):
     reply: str
 
 
-@app.post("/chat", response_model=ChatReply, tags=["Bestie Chat (Adapter)"])
+# ChatReply only documents the response: the reply is always a plain string,
+# so skip FastAPI's response_model validation pass and return a dict
+@app.post("/chat", responses={200: {"model": ChatReply}}, tags=["Bestie Chat (Adapter)"])
 async def chat_adapter(payload: ChatRequest):
     """
     Adapter endpoint to match the frontend's expected contract:
@@ -68,27 +117,39 @@ async def chat_adapter(payload: ChatRequest):
     Internally delegates to the existing chat pipeline.
     """
     try:
-        # Defer to the existing chat endpoint logic to avoid duplication
-        from app.api.endpoints.chat import ask_bestie, ChatMessage
+        # Validate and crisis-check once here and hand the result on, so the pipeline
+        # doesn't repeat it; a rejected message gets a reply without entering the pipeline
+        analysis = safety_service.analyze(payload.message)
+        validation = analysis["validation"]
+        if not validation["is_valid"]:
+            return {"reply": "I couldn't quite catch that. Could you send your message again?"}
 
-        chat_msg = ChatMessage(message=payload.message, history=[], user_id=payload.user_id)
-        result = await ask_bestie(chat_msg)
+        chat_msg = ChatMessage(
+            message=validation["sanitized_text"], history=[], user_id=payload.user_id
+        )
+        # Defer to the existing chat endpoint logic to avoid duplication
+        result = await bestie_reply(chat_msg, analysis)
         # result has shape ChatResponse with field `response`
-        return ChatReply(reply=result.response)
+        return {"reply": result.response}
     except HTTPException:
         raise
     except Exception as exc:
         raise HTTPException(status_code=500, detail=str(exc))
 
 # Global exception handler
+# Production 500 body is fixed, so encode it once instead of on every error
+PRODUCTION_ERROR_BODY = b'{"success":false,"message":"Internal server error","error":"An error occurred"}'
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
+    if settings.ENVIRONMENT != "development":
+        return Response(content=PRODUCTION_ERROR_BODY, status_code=500, media_type="application/json")
     return JSONResponse(
         status_code=500,
         content={
             "success": False,
             "message": "Internal server error",
-            "error": str(exc) if settings.ENVIRONMENT == "development" else "An error occurred"
+            "error": str(exc)
         }
     )
 
@@ -0,0 +1,96 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from cachetools import TTLCache
+
+from app.api.crud.patient_crud import insert_patient_data
+from app.core import cache
+
+
+class _StudentAnalytics:
+    """Stands in for a cached analytics service method; counts recomputations"""
+
+    def __init__(self):
+        self.records = 0
+
+    @cache.ttl_cached("student", ttl=45)
+    async def get_student_analytics(self, patient_id):
+        records = self.records
+        await asyncio.sleep(0)  # like a query: the snapshot is taken, then the loop moves on
+        return {"n": records}
+
+
+class InvalidationTest(unittest.TestCase):
+    def setUp(self):
+        # Keep the test on the in-process tier only
+        patcher = mock.patch.object(cache, "aioredis", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        asyncio.run(cache.flush())
+
+    def test_consecutive_writes_each_invalidate(self):
+        service = _StudentAnalytics()
+        db = mock.MagicMock()
+
+        async def insert(payload):
+            service.records += 1
+            return mock.Mock(inserted_id=service.records)
+
+        db.patient_metrics.insert_one = insert
+
+        async def scenario():
+            self.assertEqual(await service.get_student_analytics("p1"), {"n": 0})
+            await insert_patient_data(db, {"patient_id": "p1", "happiness": 60})
+            self.assertEqual(await service.get_student_analytics("p1"), {"n": 1})
+            await insert_patient_data(db, {"patient_id": "p1", "happiness": 70})
+            self.assertEqual(await service.get_student_analytics("p1"), {"n": 2})
+
+        asyncio.run(scenario())
+
+    def test_fill_racing_an_invalidation_is_not_stored(self):
+        service = _StudentAnalytics()
+
+        async def scenario():
+            # the read starts before the write lands and finishes after its invalidation
+            read = asyncio.create_task(service.get_student_analytics("p1"))
+            await asyncio.sleep(0)
+            service.records += 1
+            await cache.invalidate("student:p1:")
+            self.assertEqual(await read, {"n": 0})
+            self.assertEqual(len(_StudentAnalytics.get_student_analytics.cache), 0)
+
+        asyncio.run(scenario())
+
+    def test_write_invalidates_admin_caches_but_not_unrelated_ones(self):
+        db = mock.MagicMock()
+        db.patient_metrics.insert_one = mock.AsyncMock(return_value=mock.Mock(inserted_id=1))
+        report_cache = cache.register(TTLCache(maxsize=4, ttl=3600), prefix="admin")
+        user_cache = cache.register(TTLCache(maxsize=4, ttl=3600))
+        report_cache["2024-01-01T10"] = b"%PDF"
+        user_cache["token"] = "user"
+
+        async def scenario():
+            await insert_patient_data(db, {"patient_id": "p1", "happiness": 60})
+
+        asyncio.run(scenario())
+        self.assertEqual(len(report_cache), 0)
+        self.assertEqual(user_cache["token"], "user")
+
+    def test_student_invalidation_only_touches_that_student(self):
+        service = _StudentAnalytics()
+        entries = _StudentAnalytics.get_student_analytics.cache
+
+        async def scenario():
+            await service.get_student_analytics("p1")
+            await service.get_student_analytics("p10")
+            removed = await cache.invalidate("student:p1:")
+            self.assertEqual(removed, 1)
+
+        asyncio.run(scenario())
+        self.assertEqual(list(entries.owners), ["student:p10:"])
+        self.assertEqual(len(entries), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()